@@ -0,0 +1,179 @@
+import os
+import time
+import collections
+import tempfile
+import argparse
+import random
+
+from python_tracer import TRACE_FORMATS, Tracer, FrameFilter, SettraceBackend, MonitoringBackend, default_backend, create_function_from_file, iter_trace, MISSING
+from python_trace_summary import compress_trace, summarize_trace, describe_changes, index_loops, track_final_changes
+
+# Synthetic contest-style program: a mutable list and dict that change inside a
+# hot loop, immutable locals that stay put, and a small user-defined function.
+TRACE_WORKLOAD = '''n = 200
+a = [i * i for i in range(n)]
+d = {}
+s = "abc"
+t = (1, 2, 3)
+total = 0
+for i in range(n):
+    total += a[i]
+    d[i % 17] = total
+def f(x):
+    y = x + 1
+    return y
+for i in range(300):
+    total = f(total)
+'''
+
+# Source of the synthetic trace for `bench_compress`: ten loops of three lines, a
+# line outside any loop between two of them.
+COMPRESS_WORKLOAD = '''for i in range(3):
+    x = i
+    y = x
+z = 0
+''' * 10
+
+
+BACKENDS = {'settrace': SettraceBackend, 'monitoring': MonitoringBackend}
+
+
+def bench_trace(repeat, backend, trace_format, delta, loop_budget):
+    """Measure events/sec of tracing the workload into a trace file, and the size
+    of that file and the time to read it back with `iter_trace`."""
+    function_gen = create_function_from_file(TRACE_WORKLOAD)
+    frame_filter = FrameFilter(function_gen, ['f'])
+    best = 0
+    best_read = float('inf')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(repeat):
+            trace_path = os.path.join(tmp_dir, f'bench{TRACE_FORMATS[trace_format][1]}')
+            tracer = Tracer(path=trace_path, frame_filter=frame_filter, max_trace_order=10 ** 9, backend=backend,
+                            trace_format=trace_format, delta=delta, loop_budget=loop_budget)
+
+            start = time.perf_counter()
+            with tracer:
+                function_gen()
+            trace_time = time.perf_counter() - start
+
+            best = max(best, tracer.trace_order / trace_time)
+
+            start = time.perf_counter()
+            collections.deque(iter_trace(trace_path), maxlen=0)
+            best_read = min(best_read, time.perf_counter() - start)
+        size = os.path.getsize(trace_path)
+
+    print(f'backend: {type(tracer.backend).__name__}')
+    print(f'trace  events: {tracer.trace_order}')
+    print(f'events/sec: {best:,.0f}')
+    print(f'{trace_format}{" (delta)" if delta else ""} file: {size:,} bytes, read in {best_read * 1000:.1f} ms')
+
+
+def synthetic_trace_steps(steps, seed=0):
+    """`iter_trace_changes`-style steps that run short bursts of the loops of
+    `COMPRESS_WORKLOAD`, with a line outside any loop between two bursts."""
+    rng = random.Random(seed)
+    trace_steps = []
+    lineno = 1
+    value = 0
+    while len(trace_steps) < steps:
+        single_loop = rng.choice(index_loops(COMPRESS_WORKLOAD).lines)
+        for _ in range(rng.randint(1, 6)):
+            for line in single_loop:
+                value += 1
+                trace_steps.append((len(trace_steps), {'line': line + 1}, {'x': (value - 1, value)}))
+        trace_steps.append((len(trace_steps), {'line': single_loop[-1] + 2}, {'y': (MISSING, value)}))
+    return trace_steps[:steps]
+
+
+def compress_trace_nested(trace_steps, loop_detect):
+    """`compress_trace` as it was before the loop-run index: every step searches
+    the consecutive index groups of every loop. Kept as the benchmark baseline."""
+    difference_data_list = []
+    trace_string_list = []
+    previous_lineno = None
+    for step, trace, changes in trace_steps:
+        if previous_lineno is not None:
+            difference_data_list.append((previous_lineno - 1, describe_changes(changes)))
+        previous_lineno = int(trace['line'])
+
+    loop_dict = {}
+    for index, (lineno, diff_data) in enumerate(difference_data_list):
+        for single_loop in loop_detect:
+            if lineno in single_loop:
+                loop_dict.setdefault(str(single_loop), []).append(index)
+                break
+
+    grouped_dict = {}
+    for loop_name, loop_list in loop_dict.items():
+        grouped = [[loop_list[0]]]
+        for previous, index in zip(loop_list, loop_list[1:]):
+            if index == previous + 1:
+                grouped[-1].append(index)
+            else:
+                grouped.append([index])
+        grouped_dict[loop_name] = grouped
+
+    final_index = 0
+    while final_index < len(difference_data_list):
+        lineno, diff_data = difference_data_list[final_index]
+        if lineno == 0:
+            final_index += 1
+            continue
+
+        find_data = None
+        for loop_name, single_nested_list in grouped_dict.items():
+            find_data = next((inner_list for inner_list in single_nested_list if final_index in inner_list), None)
+            if find_data is not None:
+                break
+
+        if find_data is not None:
+            compressed_loop = track_final_changes([difference_data_list[i][1] for i in find_data])
+            trace_string_list.append(f'{loop_name}: ' + '{' + ' , '.join([f'{k}: {v}' for k, v in compressed_loop.items()]) + '}')
+            final_index = find_data[-1] + 1
+        else:
+            if len(diff_data.keys()) == 0:
+                trace_string_list.append(f'{lineno}: ')
+            else:
+                trace_string_list.append(f'{lineno}: ' + '{' + ' , '.join([f'{k}: {v}' for k, v in diff_data.items()]) + '}')
+            final_index += 1
+
+    return ' | '.join(trace_string_list)
+
+
+def bench_compress(repeat, steps):
+    """Time `compress_trace` against the nested-search baseline, and `summarize_trace`, on a synthetic trace."""
+    trace_steps = synthetic_trace_steps(steps)
+    loop_index = index_loops(COMPRESS_WORKLOAD)
+    assert compress_trace(trace_steps, loop_index) == compress_trace_nested(trace_steps, loop_index.lines)
+
+    for name, compress, loops in (('nested search', compress_trace_nested, loop_index.lines), ('loop-run index', compress_trace, loop_index),
+                                  ('hierarchical', summarize_trace, loop_index)):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            compress(trace_steps, loops)
+            best = min(best, time.perf_counter() - start)
+        print(f'{compress.__name__} ({name}), {steps} steps: {best * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type = int, default = 5, help = 'number of runs, the best one is reported')
+    parser.add_argument('--backend', type = str, choices = list(BACKENDS), help = 'tracing backend (default: best available)')
+    parser.add_argument('--trace_format', type = str, choices = list(TRACE_FORMATS), default = 'columnar', help = 'trace file format')
+    parser.add_argument('--delta', action = 'store_true', help = 'record only the variables that changed in each frame')
+    parser.add_argument('--loop_budget', type = int, help = 'iterations recorded at the start and at the end of every loop run')
+    parser.add_argument('--compress_steps', type = int, help = 'benchmark compress_trace on a synthetic trace of this many steps instead of tracing')
+    args = parser.parse_args()
+
+    if args.compress_steps:
+        bench_compress(args.repeat, args.compress_steps)
+        return
+
+    bench_trace(args.repeat, BACKENDS[args.backend] if args.backend else default_backend(), args.trace_format, args.delta, args.loop_budget)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,10 @@ import shutil
 import random
 import argparse
 from multiprocessing import Pool, cpu_count
-from transformers import RobertaTokenizer
+from transformers import RobertaTokenizer, RobertaTokenizerFast
 from tqdm import tqdm
+from python_tracer import iter_trace, iter_trace_changes, list_traces
+from python_trace_summary import index_loops, compress_trace, summary_levels
 
 
 def read_json(path):
@@ -19,277 +21,232 @@ def save_json(file, path):
 
 
 def open_gz(data_path: str) -> dict:
-    with gzip.open(data_path, 'rt', encoding='utf-8') as f:
-        return json.load(f)
-
-def compare_dict(dict1, dict2):
-    key_set = set(dict1.keys()).union(set(dict2.keys()))
-
-    differences = {}
-    
-    for key in key_set:
-        if key not in dict1:
-            differences[key] = f'{dict2[key]}'
-        elif key not in dict2:
-            differences[key] = f'returned'
-        elif dict1[key] != dict2[key]:
-            differences[key] = f'{dict1[key]} -> {dict2[key]}'
-    
-    return differences
+    return dict(iter_trace(data_path))
 
 def compress_file(input_file, output_file):
     with open(input_file, 'rb') as f_in:
         with gzip.open(output_file, 'wb') as f_out:
             shutil.copyfileobj(f_in, f_out)
 
-            
-def detect_complete_loops(parsed_code):
-    lines = parsed_code.split('|||')
-    in_loop = False
-    loop_structure = []
-    detected_loops = []  # List to store all detected loop structures
 
-    for line in lines:
-        # Strip leading/trailing spaces from the line
-        line = line.strip()
-    
-        if line:  # Process non-empty lines
-            # Try splitting line number and statement safely
-            parts = line.split(' ', 1)
-            
-            # Ensure both line number and statement exist before unpacking
-            if len(parts) == 2:
-                line_number, statement = parts
-                line_number = line_number.strip()
-                statement = statement.rstrip()
-                # Check if the current line is the start of a loop (for or while)
-                if statement.startswith("for ") or statement.startswith("while "):
-                    in_loop = True  # Start capturing the loop structure
-                    loop_structure.append(int(line_number))
-                elif in_loop:
-                    # Loop block continues while indented
-                    if statement.startswith("  ") or statement.startswith('\t'):  # Indentation is 4 spaces, representing a block
-                        loop_structure.append(int(line_number))
-                    else:
-                        # Stop capturing if indentation is gone (end of loop body)
-                        in_loop = False
-                        if loop_structure:
-                            # Add the detected loop to the list
-                            detected_loops.append(loop_structure)
-                            loop_structure = []  # Reset for the next loop
-            else:
-                pass
-        else:
-            # If the line is empty, continue processing
-            if in_loop:  # Ignore empty lines within a loop body
-                continue
-    
-    # If we reach the end of the code and were still in a loop, add the remaining structure
-    if in_loop and loop_structure:
-        detected_loops.append(loop_structure)
-
-    return detected_loops  # Return the list of detected loops
-
-def track_final_changes(differences_list):
-    # Initialize a dictionary to store the final changes
-    final_changes = {}
-
-    # Iterate through each differences dictionary in the list
-    for differences in differences_list:
-        for key, change in differences.items():
-            # Parse the changes (if it's a transition like "old -> new", keep the new value)
-            if '->' in change:
-                # Extract the final value from the change
-                new_value = change.split('->')[-1].strip()
-                final_changes[key] = new_value
-            else:
-                # If it's just a new addition or removal, store that
-                final_changes[key] = change
-    
-    return final_changes
+# The dataset split by problem id, the length filter and the summary kind, shared with the workers (see `init_worker`)
+PID_SPLIT_DICT = {}
+LENGTH_FILTER = None
+SUMMARY = 'hierarchical'
 
-def group_consecutive_numbers(nums):
-    if not nums:
-        return []
-    # sort the list
-    nums = sorted(nums)
-    
-    # Generate first group
-    grouped = [[nums[0]]]
+TOKENIZER_NAME = "Salesforce/codet5-base"
+MAX_TOKENS = 512  # Maximum Token length of CodeT5 model
 
-    for i in range(1, len(nums)):
-        # if the number is continuous
-        if nums[i] == nums[i - 1] + 1:
-            grouped[-1].append(nums[i])  # append at last one
-        else:
-            grouped.append([nums[i]])  # genearate new group
-
-    return grouped
-
-def find_data_in_nested_list(nested_list, target):
-    # find data in list
-    for inner_list in nested_list:
-        if target in inner_list:
-            return inner_list  
-    return None 
-
-def compress_trace(trace_data: dict, loop_detect: list) -> str:
-    trace_data_list = []
-    difference_data_list = []
-    trace_string_list = []
-
-    # Compress trace data due to token limit
-    for step, trace in trace_data.items():
-        line_number = int(trace['line'])
-        variable = trace['variables']
-        trace_data_list.append((line_number, variable))
-
-    for index in range(len(trace_data_list) - 1):
-        previous_lineno, previous_data = trace_data_list[index]
-        new_lineno, new_data = trace_data_list[index + 1]
-        differences = compare_dict(previous_data, new_data)
-        difference_data_list.append((previous_lineno - 1, differences))
-
-    loop_dict = {}
-
-    for index, (lineno, diff_data) in enumerate(difference_data_list):
-        for single_loop in loop_detect:
-            if lineno in single_loop:
-                if str(single_loop) not in loop_dict.keys():
-                    loop_dict[str(single_loop)] = [index]
-                else:
-                    loop_dict[str(single_loop)].append(index)
-                break
-
-    grouped_dict = {}
-
-    for loop_name, loop_list in loop_dict.items():
-        grouped_dict[loop_name] = group_consecutive_numbers(loop_list)
-
-    final_index = 0
-
-    while(1):
-        if final_index >= len(difference_data_list):
-            break
-
-        lineno, diff_data = difference_data_list[final_index]
-        if lineno == 0:
-            final_index += 1
-            continue
-
-        find_data = None  
-        
-        for loop_name, single_nested_list in grouped_dict.items():
-            find_data = find_data_in_nested_list(single_nested_list, final_index)
-            if find_data is not None:
-                break
-
-        if find_data is not None:
-            single_loop_data = []
-            for i in find_data:
-                _, diff = difference_data_list[i]
-                single_loop_data.append(diff)
-
-            compressed_loop = track_final_changes(single_loop_data)
-            trace_string_list.append(f'{loop_name}: ' + '{' + ' , '.join([f'{k}: {v}' for k, v in compressed_loop.items()]) + '}')
-            final_index = find_data[-1] + 1
-        else:
-            if len(diff_data.keys()) == 0:
-                trace_string_list.append(f'{lineno}: ')
-            else:
-                trace_string_list.append(f'{lineno}: ' + '{' + ' , '.join([f'{k}: {v}' for k, v in diff_data.items()]) + '}')
 
-            final_index += 1
+class LengthFilter:
+    """Decide which trace-added samples of one code fit in `max_tokens` tokens.
+
+    All samples of a code share the code as a prefix and differ in the trace
+    comment only. The comment starts with a space, where the byte-level BPE
+    pre-tokenizer always splits, so the token count of a sample is the count of
+    the code (with the special tokens) plus the count of its comment. The code is
+    tokenized once and the comments in one batch.
+
+    Before tokenizing, a sample is rejected when it has more than `max_chars`
+    characters and accepted when it has at most `max_tokens` bytes minus the
+    special tokens, as a byte-level BPE token covers at least one byte. The
+    default `max_chars` is `max_tokens` times the longest token of the vocabulary,
+    which never rejects a sample that fits; a smaller value trades exactness for
+    speed.
 
-    return ' | '.join(trace_string_list)
+    The count of the last code is kept, for the further samples of that code."""
 
+    def __init__(self, tokenizer, max_tokens: int = MAX_TOKENS, max_chars: int = None) -> None:
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        if max_chars is None:
+            max_chars = max_tokens * max(len(token) for token in tokenizer.get_vocab())
+        self.max_chars = max_chars
+        self.special_tokens = tokenizer.num_special_tokens_to_add()
+        self.last_code = None
+        self.last_code_tokens = 0
+
+    def count(self, texts: list, add_special_tokens: bool) -> list:
+        encoded = self.tokenizer(texts, add_special_tokens=add_special_tokens, truncation=False)
+        return [len(input_ids) for input_ids in encoded['input_ids']]
+
+    def code_tokens(self, code: str) -> int:
+        if code != self.last_code:
+            self.last_code, self.last_code_tokens = code, self.count([code], add_special_tokens=True)[0]
+        return self.last_code_tokens
+
+    def fits(self, code: str, comments: list) -> list:
+        fits = [False] * len(comments)
+        pending = []
+
+        for index, comment in enumerate(comments):
+            text = code + comment
+            if len(text) > self.max_chars:
+                continue
+            if len(text.encode()) + self.special_tokens <= self.max_tokens:
+                fits[index] = True
+            else:
+                pending.append(index)
+
+        if not pending:
+            return fits
+
+        code_tokens = self.code_tokens(code)
+        if code_tokens > self.max_tokens:
+            return fits
+
+        comment_tokens = self.count([comments[index] for index in pending], add_special_tokens=False)
+        for index, tokens in zip(pending, comment_tokens):
+            fits[index] = code_tokens + tokens <= self.max_tokens
+        return fits
+
+    def fit_first(self, code: str, candidates: list) -> list:
+        """Choose one comment per sample from `candidates`, an iterator of comments
+        per sample, the most wanted first.
+
+        Return `(comment, fits)` per sample: its first comment that fits, or its
+        last one if none does. Every round checks the next comment of all samples
+        still without one in a single `fits` call, so a code takes one tokenizer
+        call per round, not per sample and comment."""
+        chosen = [None] * len(candidates)
+        fits = [False] * len(candidates)
+        pending = range(len(candidates))
+        while pending:
+            checked = []
+            for index in pending:
+                comment = next(candidates[index], None)
+                if comment is not None:
+                    chosen[index] = comment
+                    checked.append(index)
+            for index, comment_fits in zip(checked, self.fits(code, [chosen[index] for index in checked])):
+                fits[index] = comment_fits
+            pending = [index for index in checked if not fits[index]]
+        return list(zip(chosen, fits))
+
+
+def split_by_pid(raw_json):
+    # Split the data based on problem id
+    pid_split_dict = {}
+    for single_storage in raw_json:
+        pid_index = single_storage['pid']
+        if pid_index in pid_split_dict:
+            pid_split_dict[pid_index].append((len(pid_split_dict[pid_index]), single_storage))
+        else:
+            pid_split_dict[pid_index] = [(0, single_storage)]
+    return pid_split_dict
+
+def load_tokenizer():
+    # The Rust-backed tokenizer when it is available locally, the Python one otherwise
+    try:
+        return RobertaTokenizerFast.from_pretrained(TOKENIZER_NAME, local_files_only=True)
+    except (OSError, ValueError, ImportError):
+        return RobertaTokenizer.from_pretrained(TOKENIZER_NAME)
+
+def init_worker(json_file_path, max_tokens, max_chars, summary):
+    # Forked workers inherit the dataset and length filter the parent loaded; others load them once here
+    global LENGTH_FILTER, SUMMARY
+    if not PID_SPLIT_DICT:
+        PID_SPLIT_DICT.update(split_by_pid(read_json(json_file_path)))
+    if LENGTH_FILTER is None:
+        LENGTH_FILTER = LengthFilter(load_tokenizer(), max_tokens=max_tokens, max_chars=max_chars)
+    SUMMARY = summary
+
+def group_by_code(trace_list):
+    # Traces of one code, named `..._<code index>_<case index>.<format>.gz`, in input order
+    code_dict = {}
+    for incorrect_data in trace_list:
+        split_index = os.path.basename(incorrect_data).split('_')
+        code_dict.setdefault(int(split_index[3]), []).append(incorrect_data)
+    return code_dict
+
+def trace_comments(comment_head, compressed_traces):
+    # The full trace comment of every compressed trace of one input
+    for compressed_trace in compressed_traces:
+        yield comment_head + compressed_trace + ']'
 
 def process_code(args):
-    pid_index, incorrect_data, pid_split_dict, tokenizer = args
+    pid_index, code_index, incorrect_list = args
     trace_added_list = []
 
-    split_index = os.path.basename(incorrect_data).split('_')
-    code_index = split_index[3]
-    case_index = split_index[4].split('.json')[0]
-
     # Load data from original incorrect data
-    stored_data = pid_split_dict[pid_index][int(code_index)]
-    stored_index, full_data = stored_data
-    assert int(code_index) == int(stored_index)
+    stored_index, stored_data = PID_SPLIT_DICT[pid_index][code_index]
+    assert code_index == int(stored_index)
 
-    # Make trace comment added code
-    input_data = full_data['test_case']['input'][int(case_index)]
-    output_data = full_data['test_case']['output'][int(case_index)]
+    if 'def main' in stored_data['incorrect_code']:
+        return trace_added_list
 
-    loop_detect_data = full_data['incorrect_code']
-    loop_detect = detect_complete_loops(loop_detect_data)
+    # Loops of the traced source, whose lines the traces are numbered by
+    loop_index = index_loops(stored_data['raw_incorrect'])
 
-    # Generate trace compressed data
-    single_incorrect_trace = open_gz(incorrect_data)
-    compressed_trace = compress_trace(single_incorrect_trace, loop_detect)
+    candidate_list = []
+    comment_list = []  # Per input, an iterator of comments from the most to the least detailed trace
 
-    full_comment = ' # @Input = [' + input_data +  '] @Expected = [' + output_data + '] @Trace = [' + compressed_trace + ']'
+    for incorrect_data in incorrect_list:
+        case_index = os.path.basename(incorrect_data).split('_')[4].split('.')[0]  # `.json.gz` or `.vtr.gz`
+        # Other inputs of the same code share the stored entry; annotate a copy
+        full_data = dict(stored_data)
 
-    trace_added_code = full_data['incorrect_code'] + full_comment
-    full_data['trace_code'] = trace_added_code
-    full_data['code_index'] = int(code_index)
+        # Make trace comment added code
+        input_data = full_data['test_case']['input'][int(case_index)]
+        output_data = full_data['test_case']['output'][int(case_index)]
 
-    # Choose only data whose token length is under 512(Maximum Token length of CodeT5 model)
-    input_hf = tokenizer(trace_added_code, truncation=False)
-    if len(input_hf.input_ids) > 512:
-        return trace_added_list  # Skip if too long
-    
-    if 'def main' in full_data['incorrect_code']:
-        return trace_added_list
+        # Generate trace compressed data; the hierarchical summary offers coarser levels until one fits
+        comment_head = ' # @Input = [' + input_data +  '] @Expected = [' + output_data + '] @Trace = ['
+        if SUMMARY == 'hierarchical':
+            compressed_traces = summary_levels(iter_trace_changes(incorrect_data), loop_index)
+        else:
+            compressed_traces = [compress_trace(iter_trace_changes(incorrect_data), loop_index)]
+
+        full_data['code_index'] = code_index
+        candidate_list.append(full_data)
+        comment_list.append(trace_comments(comment_head, compressed_traces))
 
-    # Save the full data
-    trace_added_list.append(full_data)
+    # Choose only data whose token length is under max_tokens (512, Maximum Token length of CodeT5 model)
+    for full_data, (full_comment, fits) in zip(candidate_list, LENGTH_FILTER.fit_first(stored_data['incorrect_code'], comment_list)):
+        if fits:
+            full_data['trace_code'] = full_data['incorrect_code'] + full_comment
+            trace_added_list.append(full_data)
     return trace_added_list
 
 
 def main():
     base_path = os.getcwd()
     trace_path = os.path.join(base_path, 'python_trace')
-    tokenizer = RobertaTokenizer.from_pretrained("Salesforce/codet5-base")
-    
+    global LENGTH_FILTER, SUMMARY
+
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_split', type = str, help = 'valid. test, train')
+    parser.add_argument('--summary', type = str, choices = ['hierarchical', 'flat'], default = 'hierarchical', help = 'per-level loop summaries fitted to the token budget, or the final changes of each outermost loop')
+    parser.add_argument('--max_tokens', type = int, default = MAX_TOKENS, help = 'token budget of a sample: code, input, expected output and trace')
+    parser.add_argument('--max_chars', type = int, help = 'reject samples longer than this many characters without tokenizing them (default: exact bound from the vocabulary)')
     parser.parse_args()
     args = parser.parse_args()
     data_type = args.data_split
     
     split_type = [data_type]
+    LENGTH_FILTER = LengthFilter(load_tokenizer(), max_tokens=args.max_tokens, max_chars=args.max_chars)
+    SUMMARY = args.summary
 
     for s_t in tqdm(split_type, desc='Valid, Test, Train'):
-        pid_split_dict = {}
         all_trace_added_list = []
 
         trace_type_path = os.path.join(trace_path, s_t, 'python_incorrect')
-        data_list = os.listdir(trace_type_path)
         json_file_path = os.path.join(base_path, 'python_data', f'python_{s_t}_baseline_400.json')
         raw_json = read_json(json_file_path)
 
-        # Split the data based on problem id
-        for single_storage in raw_json:
-            pid_index = single_storage['pid']
-            if pid_index in pid_split_dict:
-                pid_split_dict[pid_index].append((len(pid_split_dict[pid_index]), single_storage))
-            else:
-                pid_split_dict[pid_index] = [(0, single_storage)]
+        PID_SPLIT_DICT.clear()
+        PID_SPLIT_DICT.update(split_by_pid(raw_json))
 
-        # Prepare arguments for multiprocessing
+        # Prepare arguments for multiprocessing, one task per code; the workers already hold the dataset and the length filter
         args_list = []
-        for pid_index in data_list:
-            pid_path = os.path.join(trace_type_path, pid_index)
-            incorrect_list = os.listdir(pid_path)
-
-            for single_incorrect in incorrect_list:
-                incorrect_data = os.path.join(pid_path, single_incorrect)
-                args_list.append((pid_index, incorrect_data, pid_split_dict, tokenizer))
+        # Pid directories and pid archives written by `python_multi_trace.py --pack` alike
+        for pid_index, incorrect_list in list_traces(trace_type_path).items():
+            for code_index, code_incorrect_list in group_by_code(incorrect_list).items():
+                args_list.append((pid_index, code_index, code_incorrect_list))
 
         # Use multiprocessing Pool
-        with Pool(120) as pool:  # Use one less CPU than available
-            for result in tqdm(pool.imap_unordered(process_code, args_list, chunksize=250), total=len(args_list), desc="Processing Codes"):
+        with Pool(120, initializer=init_worker, initargs=(json_file_path, args.max_tokens, args.max_chars, args.summary)) as pool:  # Use one less CPU than available
+            for result in tqdm(pool.imap_unordered(process_code, args_list, chunksize=25), total=len(args_list), desc="Processing Codes"):
                 all_trace_added_list.extend(result)
 
         # Save the results
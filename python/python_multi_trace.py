@@ -0,0 +1,590 @@
+from python_tracer import TRACE_FORMAT_VERSION, TRACE_FORMATS, Tracer, ValueSummarizer, find_loops, FrameFilter, SettraceBackend, MonitoringBackend, StdinEmulator, TimeoutException, MaxTraceOrderExceededException, OUTCOME_OK, outcome_of, compile_wrapper, load_function, pack_traces, TRACE_PACK_SUFFIX
+from tqdm import tqdm
+from multiprocessing import Pool
+from collections import Counter
+
+import sys
+import os
+import time
+import types
+import statistics
+import json
+import argparse
+import hashlib
+import shutil
+import pickle
+import functools
+import gc
+import select
+import signal
+import resource
+import sqlite3
+import zipfile
+
+BACKENDS = {'settrace': SettraceBackend, 'monitoring': MonitoringBackend}
+
+# Defaults, overridden by the `--config` file, which is overridden by the command line
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python_multi_trace_config.json')
+
+# Outcome of an isolated child that was killed or died before reporting one
+OUTCOME_KILLED = 'killed'
+
+class OutcomeStore:
+    """SQLite table of the outcome of every traced input, to query after a run.
+
+    Rows come from the workers' results, which the pool already sends back to
+    the parent over its result queue; the parent is the only writer and
+    inserts them in batches of `batch_size`, one transaction per batch. An
+    input whose trace was taken from the trace cache gets an `ok` row with
+    `cached` set (see `cached_result`). A rerun replaces the row of an input
+    it traces again. For example:
+
+        sqlite3 python_trace/outcomes.sqlite \
+            "select split, outcome, count(*) from outcomes group by split, outcome"
+    """
+
+    COLUMNS = ('path', 'split', 'kind', 'pid', 'code_index', 'input_index', 'outcome',
+               'exception', 'error', 'events', 'steps', 'seconds', 'cached')
+
+    def __init__(self, path, batch_size=1000):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS outcomes (path TEXT PRIMARY KEY, split TEXT, kind TEXT, pid TEXT,"
+            " code_index INTEGER, input_index INTEGER, outcome TEXT, exception TEXT, error TEXT,"
+            " events INTEGER, steps INTEGER, seconds REAL, cached INTEGER)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(outcomes)")]
+        if 'cached' not in columns:
+            self.connection.execute("ALTER TABLE outcomes ADD COLUMN cached INTEGER")  # Table of an older run
+        self.connection.execute("CREATE INDEX IF NOT EXISTS outcomes_by_pid ON outcomes (pid, code_index, input_index)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS outcomes_by_outcome ON outcomes (outcome)")
+        self.batch_size = batch_size
+        self.rows = []
+
+    def add(self, result):
+        self.rows.append(tuple(result[column] for column in self.COLUMNS))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        placeholders = ', '.join('?' * len(self.COLUMNS))
+        with self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO outcomes VALUES ({placeholders})", self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+class Manifest:
+    """Append-only log of traced inputs, one JSON line per outcome.
+
+    Each line records the trace path, a content hash of the code and input
+    (see `task_hash`), whether tracing finished or failed, the outcome code
+    (see `outcome_of`) and how many seconds it took. The last line
+    for a path wins, so a rerun skips inputs that finished with the same
+    content and retries the ones that failed or never finished."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Line cut short by an interrupted run
+                    self.entries[entry['path']] = entry
+        self.file = open(path, 'a')
+
+    def is_complete(self, trace_path, digest, exists=os.path.exists):
+        entry = self.entries.get(trace_path)
+        return (entry is not None and entry['hash'] == digest and entry['status'] == 'ok'
+                and exists(trace_path))
+
+    def record(self, trace_path, digest, error, outcome=None, seconds=None):
+        entry = {'path': trace_path, 'hash': digest, 'status': 'ok' if error is None else 'failed'}
+        if outcome is not None:
+            entry['outcome'] = outcome
+        if seconds is not None:
+            entry['seconds'] = round(seconds, 3)
+        self.entries[trace_path] = entry
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class RuntimeHistory:
+    """Append-only log of how many seconds tracing took, keyed by `task_hash`.
+
+    Unlike the manifest it is kept by `--no-resume`, so a fresh run schedules
+    inputs by the runtimes of earlier runs (see `order_by_cost`). Keying by
+    content hash carries a runtime over to the same code and input under
+    another path, and drops it once the code, the input or the trace options
+    change. The last line for a hash wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self.seconds = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Line cut short by an interrupted run
+                    self.seconds[entry['hash']] = entry['seconds']
+        self.file = open(path, 'a')
+
+    def get(self, digest):
+        """Seconds an earlier run took to trace `digest`, or None if it is not known."""
+        return self.seconds.get(digest)
+
+    def record(self, digest, seconds):
+        seconds = round(seconds, 3)
+        self.seconds[digest] = seconds
+        self.file.write(json.dumps({'hash': digest, 'seconds': seconds}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class TraceCache:
+    """Content-addressed store of finished traces, keyed by `task_hash`.
+
+    Code pairs often share a program and its test inputs across pids and
+    splits. A trace is stored once under `<root>/<hash[:2]>/<hash><suffix>`
+    and hard-linked (copied where links are not supported) to every trace
+    path with the same hash instead of running the program again."""
+
+    def __init__(self, root, suffix):
+        self.root = root
+        self.suffix = suffix  # Of the trace format, see `TRACE_FORMATS`
+        self.hits = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}{self.suffix}")
+
+    def link(self, source, target):
+        """Atomically make `target` refer to the contents of `source`."""
+        if os.path.exists(target) and os.path.samefile(source, target):
+            return  # Already linked; renaming a link onto itself would leave `temp_path` behind
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+
+    def fetch(self, digest, trace_path):
+        """Put the cached trace for `digest` at `trace_path`. Return False if there is none."""
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            return False
+        self.link(blob, trace_path)
+        self.hits += 1
+        return True
+
+    def store(self, digest, trace_path):
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        self.link(trace_path, blob)
+
+class OutputLayout:
+    """Directories and paths of the trace files of a run, planned before tracing starts.
+
+    Traces go to `python_trace/<split>/<kind>/<pid>/<kind>_<pid>_<code index>_<input index><suffix>`.
+    `plan` creates the directory of every pid of a split once, before any task
+    is set up. With `pack`, `pack` then moves the traces of each pid directory
+    into one zip archive next to it (see `python_tracer.pack_traces`), from
+    which `python_tracer.open_trace` reads them under their original paths."""
+
+    KINDS = ('python_correct', 'python_incorrect')
+
+    def __init__(self, options):
+        self.root = os.path.join(options['output_root'], 'python_trace')
+        self.suffix = trace_suffix(options)
+        self.directories = []
+        self.packed = set()  # Trace paths already moved into packs
+
+    def pid_dir(self, split, kind, pid):
+        return os.path.join(self.root, split, kind, pid)
+
+    def trace_path(self, split, kind, pid, code_index, input_index):
+        return os.path.join(self.pid_dir(split, kind, pid), f'{kind}_{pid}_{code_index}_{input_index}{self.suffix}')
+
+    def plan(self, split, data):
+        """Create the directories of all pids of `split` and note the traces already packed."""
+        for pid in sorted({single_code_data['pid'] for single_code_data in data}):
+            for kind in self.KINDS:
+                directory = self.pid_dir(split, kind, pid)
+                os.makedirs(directory, exist_ok=True)
+                self.directories.append(directory)
+                pack = directory + TRACE_PACK_SUFFIX
+                if os.path.exists(pack):
+                    with zipfile.ZipFile(pack) as archive:
+                        self.packed.update(os.path.join(directory, name) for name in archive.namelist())
+
+    def exists(self, trace_path):
+        return trace_path in self.packed or os.path.exists(trace_path)
+
+    def pack(self):
+        """Pack the traces of every planned pid directory. Return the number of files packed
+        and of archives written; directories without traces get no archive."""
+        counts = [pack_traces(directory) for directory in self.directories if os.path.isdir(directory)]
+        return sum(counts), sum(1 for count in counts if count)
+
+def trace_suffix(options):
+    return TRACE_FORMATS[options['trace_format']][1]
+
+def task_hash(code, inputs, options):
+    """Content hash of one traced input: the code, the input, the options that shape the trace and the
+    tracer version (`TRACE_FORMAT_VERSION` and the Python version, which decides the line events)."""
+    digest = hashlib.sha256()
+    python_version = f'{sys.version_info.major}.{sys.version_info.minor}'
+    for part in (code, inputs, str(options['max_trace_order']), str(options['loop_budget']), str(options['max_events']), str(options['summary_threshold']), str(options['summary_items']), options['trace_format'], str(options['delta']), str(options['keyframe_interval']), str(TRACE_FORMAT_VERSION), python_version):
+        digest.update(part.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def trace_variable(inputs, function_curated, file_path, frame_filter, options):
+    """Trace one input of a program.
+
+    Return a dict with the number of recorded `events`, the `steps` the
+    program ran, the `outcome` code and, if it failed, the `exception` type
+    and the `error` message."""
+    result = {'events': 0, 'steps': None, 'outcome': OUTCOME_OK, 'exception': None, 'error': None}
+    tracer = None
+
+    # Redirect stdout and stderr to suppress output
+    original_stdout = sys.stdout
+    original_stderr = sys.stderr
+    with open(os.devnull, 'w') as devnull, StdinEmulator(inputs):
+        sys.stdout = devnull
+        sys.stderr = devnull
+
+        try:
+            summarizer = ValueSummarizer(options['summary_threshold'], options['summary_items']) if options['summary_threshold'] else None
+            tracer = Tracer(path=file_path, frame_filter=frame_filter, max_trace_order=options['max_trace_order'],
+                            timeout=options['timeout'], backend=BACKENDS.get(options['backend']),
+                            trace_format=options['trace_format'], delta=options['delta'],
+                            keyframe_interval=options['keyframe_interval'], loop_budget=options['loop_budget'] or None,
+                            max_events=options['max_events'], summarizer=summarizer)
+            with tracer:
+                function_curated()
+        except SystemExit:
+            pass  # exit() and sys.exit() end the program like reaching its last line
+        except (TimeoutException, MaxTraceOrderExceededException, Exception) as e:
+            result.update(outcome=outcome_of(e), exception=type(e).__name__, error=f'{e}')
+
+        finally:
+            # Restore stdout and stderr; StdinEmulator restores stdin and input
+            sys.stdout = original_stdout
+            sys.stderr = original_stderr
+
+    if tracer is not None:
+        result.update(events=tracer.trace_order, steps=tracer.deadline.steps)
+        # Tracing stopped at a limit even if the program caught the exception and ran on
+        exceeded = tracer.exceeded
+        if exceeded is not None:
+            result.update(outcome=outcome_of(exceeded), exception=type(exceeded).__name__, error=f'{exceeded}')
+    return result
+
+def cached_result(split, kind, pid, code_index, input_index, path, digest):
+    """Result of an input whose trace was taken from the trace cache instead of traced."""
+    return {'path': path, 'hash': digest, 'cached': True, 'split': split, 'kind': kind, 'pid': pid,
+            'code_index': code_index, 'input_index': input_index, 'outcome': OUTCOME_OK,
+            'exception': None, 'error': None, 'events': None, 'steps': None, 'seconds': None}
+
+def killed_result(reason):
+    """Result of an input whose isolated child died before reporting one."""
+    return {'events': 0, 'steps': None, 'outcome': OUTCOME_KILLED, 'exception': None, 'error': reason}
+
+def set_resource_limits(options):
+    """Limit the address space (MB) and CPU time (s) of the current process."""
+    memory = options['memory_limit'] * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CPU, (options['cpu_limit'], options['cpu_limit'] + 1))
+
+def run_isolated(function, args, options):
+    """Run `function(*args)` in a forked child under resource limits and return its result.
+
+    The result comes back pickled over a pipe. A child that is still running
+    after `kill_timeout` seconds is killed; a child that dies without a result
+    yields `killed_result(<reason>)`, so one pathological program cannot take down the worker."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            set_resource_limits(options)
+            result = function(*args)
+            with os.fdopen(write_fd, 'wb') as pipe:
+                pickle.dump(result, pipe)
+            status = 0
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    chunks = []
+    killed = False
+    deadline = time.monotonic() + options['kill_timeout']
+    with os.fdopen(read_fd, 'rb') as pipe:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([pipe], [], [], remaining)[0]:
+                os.kill(pid, signal.SIGKILL)
+                killed = True
+                break
+            chunk = os.read(pipe.fileno(), 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    _, status = os.waitpid(pid, 0)
+
+    if killed:
+        return killed_result(f"Killed after {options['kill_timeout']}s wall-clock limit")
+    if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+        return pickle.loads(b''.join(chunks))
+    if os.WIFSIGNALED(status):
+        signal_number = os.WTERMSIG(status)
+        if signal_number == signal.SIGXCPU:
+            return killed_result(f"CPU time limit of {options['cpu_limit']}s exceeded")
+        return killed_result(f"Killed by {signal.Signals(signal_number).name}")
+    return killed_result(f"Exited with status {os.WEXITSTATUS(status)}")
+
+def dataset_path(options, split):
+    return os.path.join(options['data_root'], f'python_{split}_baseline_400.json')
+
+# The datasets and options of a run, shared with the workers of its pool (see `init_worker`)
+DATASETS = {}
+WORKER_OPTIONS = {}
+
+def init_worker(options):
+    """Pool initializer: make the datasets of the run available to `trace_input`.
+
+    Forked workers inherit `DATASETS` from the parent, which loads them before
+    it starts the pool, and share its memory pages copy-on-write; workers
+    started any other way read the dataset files once."""
+    WORKER_OPTIONS.update(options)
+    for split in options['splits']:
+        if split not in DATASETS:
+            DATASETS[split] = read_json(dataset_path(options, split))
+
+def read_json(path):
+    with open(path, 'r') as f:
+        json_data = json.load(f)
+    return json_data
+
+@functools.lru_cache(maxsize=16)
+def load_program(code):
+    """The `trace_func` of `code` and its frame filter, shared by the inputs of a program a worker traces."""
+    wrapper_code = compile_wrapper(code)
+    function_gen = load_function(wrapper_code)
+    return function_gen, FrameFilter(function_gen, [])
+
+def trace_input(task):
+    """Function to trace one input of a code pair for multiprocessing.
+
+    A task only refers to its code pair by split and index into the datasets
+    the worker shares with the parent (see `init_worker`), so no source or
+    input is pickled. Return a dict with the `path` and `hash` of the trace,
+    whether it was `cached` and the columns of its `OutcomeStore` row."""
+    split, index, code_index, is_correct, input_index, digest = task
+    options = WORKER_OPTIONS
+    single_code_data = DATASETS[split][index]
+    pid = single_code_data['pid']
+    kind = 'python_correct' if is_correct else 'python_incorrect'
+    code = single_code_data['raw_correct'] if is_correct else single_code_data['raw_incorrect']
+    inputs = single_code_data['test_case']['input'][input_index]
+    code_filepath = OutputLayout(options).trace_path(split, kind, pid, code_index, input_index)
+
+    # An identical input may have been traced by another worker in the meantime
+    cache = TraceCache(options['cache_root'], trace_suffix(options)) if options['cache'] else None
+    if cache is not None and cache.fetch(digest, code_filepath):
+        return cached_result(split, kind, pid, code_index, input_index, code_filepath, digest)
+
+    start = time.perf_counter()
+    function_gen, frame_filter = load_program(code)
+    trace_args = (inputs.split('\n'), function_gen, code_filepath, frame_filter, options)
+    if options['isolation'] == 'fork':
+        result = run_isolated(trace_variable, trace_args, options)
+        if os.path.exists(f"{code_filepath}.tmp"):
+            os.remove(f"{code_filepath}.tmp")  # Left by a killed child
+    else:
+        result = trace_variable(*trace_args)
+    if result['error'] is None and cache is not None:
+        cache.store(digest, code_filepath)
+    result.update(path=code_filepath, hash=digest, cached=False, seconds=time.perf_counter() - start,
+                  split=split, kind=kind, pid=pid, code_index=code_index, input_index=input_index)
+    return result
+
+def count_loops(code):
+    """Number of loops in a code object and the code objects nested in it."""
+    loops = sum(len(starting) for starting in find_loops(code).values())
+    return loops + sum(count_loops(const) for const in code.co_consts if isinstance(const, types.CodeType))
+
+def setup_tracing(data, split, is_correct, options, layout, manifest=None, cache=None, runtimes=None, store=None):
+    """Set up the tasks for tracing into the directories `layout` planned.
+
+    Yield one `(cost, seconds, task)` per input: the estimated cost of tracing it
+    (see `order_by_cost`), the seconds it took in an earlier run, if `runtimes`
+    knows them, and the task for `trace_input`, which refers to the code pair
+    by its index in `data`. Inputs the manifest marks complete are left
+    out, and inputs with a cached trace are linked from the cache and recorded
+    in the manifest and the outcome `store` right away."""
+    kind = 'python_correct' if is_correct else 'python_incorrect'
+    pid_save = {}
+    for index, single_code_data in enumerate(data):
+
+        pid = single_code_data['pid']
+        test_case_input = single_code_data['test_case']['input']
+
+        if pid not in pid_save.keys():
+            pid_save[pid] = 0
+        elif pid in pid_save.keys():
+            pid_save[pid] = pid_save[pid] + 1
+
+        code = single_code_data['raw_correct'] if is_correct else single_code_data['raw_incorrect']
+
+        # Compiled here to skip code that does not compile and to count its loops
+        wrapper_code = compile_wrapper(code)
+        if wrapper_code is None:
+            continue  # Does not compile, nothing to trace
+
+        loops = count_loops(wrapper_code)
+        for input_index, inputs in enumerate(test_case_input):
+            digest = task_hash(code, inputs, options)
+            trace_path = layout.trace_path(split, kind, pid, pid_save[pid], input_index)
+            if manifest is not None and manifest.is_complete(trace_path, digest, layout.exists):
+                continue
+            if cache is not None and cache.fetch(digest, trace_path):
+                if manifest is not None:
+                    manifest.record(trace_path, digest, None)
+                if store is not None:
+                    store.add(cached_result(split, kind, pid, pid_save[pid], input_index, trace_path, digest))
+                continue
+            cost = (len(code) + len(inputs)) * (1 + loops)
+            seconds = runtimes.get(digest) if runtimes is not None else None
+            yield cost, seconds, (split, index, pid_save[pid], is_correct, input_index, digest)
+
+def order_by_cost(entries):
+    """Order `(cost, seconds, task)` entries so the slowest tasks come first.
+
+    An input with a runtime from an earlier run (see `RuntimeHistory`) is placed by that runtime. The
+    others are placed by their cost (source and input length times one plus
+    the number of loops), converted to seconds by the median runtime per cost
+    unit of the inputs that have both."""
+    ratios = [seconds / cost for cost, seconds, task in entries if seconds is not None and cost > 0]
+    seconds_per_cost = statistics.median(ratios) if ratios else 1.0
+    entries = sorted(entries, key=lambda entry: entry[1] if entry[1] is not None else entry[0] * seconds_per_cost, reverse=True)
+    return [task for cost, seconds, task in entries]
+
+def load_config(argv=None):
+    """Merge the defaults, the `--config` JSON file and the command line options."""
+    parser = argparse.ArgumentParser(description = 'Trace the variables of the python code pairs of several splits')
+    parser.add_argument('--config', type = str, help = 'JSON file with any of the options below')
+    parser.add_argument('--splits', type = str, nargs = '+', help = 'splits to trace, e.g. test valid train')
+    parser.add_argument('--data_root', type = str, help = 'directory with python_<split>_baseline_400.json')
+    parser.add_argument('--output_root', type = str, help = 'directory that receives python_trace/')
+    parser.add_argument('--pool_size', type = int, help = 'number of worker processes')
+    parser.add_argument('--max_trace_order', type = int, help = 'maximum number of trace events per input')
+    parser.add_argument('--loop_budget', type = int, help = 'iterations recorded at the start and at the end of every loop run; 0 records all')
+    parser.add_argument('--max_events', type = int, help = 'maximum number of events per input, including those a loop budget leaves out')
+    parser.add_argument('--summary_threshold', type = int, help = 'containers with more elements are recorded as summaries; 0 records them whole')
+    parser.add_argument('--summary_items', type = int, help = 'elements kept at the start and at the end of a summarized container')
+    parser.add_argument('--trace_format', type = str, choices = list(TRACE_FORMATS), help = 'trace file format')
+    parser.add_argument('--delta', action = argparse.BooleanOptionalAction, help = 'record only the variables that changed in each frame (default: on)')
+    parser.add_argument('--keyframe_interval', type = int, help = 'events of a frame between two full snapshots in delta mode')
+    parser.add_argument('--timeout', type = float, help = 'seconds allowed per input, checked on every traced event')
+    parser.add_argument('--backend', type = str, choices = list(BACKENDS), help = 'tracing backend (default: best available)')
+    parser.add_argument('--isolation', type = str, choices = ['fork', 'none'], help = 'run every input in a forked, resource-limited child (default) or in the worker')
+    parser.add_argument('--memory_limit', type = int, help = 'address space limit of an isolated child in MB')
+    parser.add_argument('--cpu_limit', type = int, help = 'CPU time limit of an isolated child in seconds')
+    parser.add_argument('--kill_timeout', type = float, help = 'wall-clock seconds after which an isolated child is killed')
+    parser.add_argument('--max_tasks_per_child', type = int, help = 'tasks (inputs) a worker traces before it is replaced')
+    parser.add_argument('--resume', action = argparse.BooleanOptionalAction, help = 'skip inputs the manifest records as complete (default: on)')
+    parser.add_argument('--cache', action = argparse.BooleanOptionalAction, help = 'reuse traces of identical code and input from python_trace/cache (default: on)')
+    parser.add_argument('--pack', action = argparse.BooleanOptionalAction, help = 'move the traces of every pid into one zip archive after the run (default: off)')
+    args = parser.parse_args(argv)
+
+    options = read_json(DEFAULT_CONFIG_PATH)
+    if args.config is not None:
+        options.update(read_json(args.config))
+    for key, value in vars(args).items():
+        if key != 'config' and value is not None:
+            options[key] = value
+    if options['backend'] == 'monitoring' and not hasattr(sys, 'monitoring'):
+        # Otherwise every input would fail inside `trace_variable` and be recorded as a runtime error
+        print("sys.monitoring needs Python 3.12 or later; tracing with sys.settrace instead", file=sys.stderr)
+        options['backend'] = 'settrace'
+    return options
+
+def main(argv=None):
+    options = load_config(argv)
+
+    os.makedirs(os.path.join(options['output_root'], 'python_trace'), exist_ok=True)
+    manifest_path = os.path.join(options['output_root'], 'python_trace', 'manifest.jsonl')
+    outcomes_path = os.path.join(options['output_root'], 'python_trace', 'outcomes.sqlite')
+    if not options['resume']:
+        for path in (manifest_path, outcomes_path):
+            if os.path.exists(path):
+                os.remove(path)
+    manifest = Manifest(manifest_path)
+    # Outlives --no-resume, so reruns from scratch are still scheduled by measured runtimes
+    runtimes = RuntimeHistory(os.path.join(options['output_root'], 'python_trace', 'runtimes.jsonl'))
+    store = OutcomeStore(outcomes_path)
+    options['cache_root'] = os.path.join(options['output_root'], 'python_trace', 'cache')
+    cache = TraceCache(options['cache_root'], trace_suffix(options)) if options['cache'] else None
+    layout = OutputLayout(options)
+
+    # One work queue over all splits, so every split shares the same warm pool
+    entries = []
+    for split in options['splits']:
+        input_data = DATASETS[split] = read_json(dataset_path(options, split))
+
+        layout.plan(split, input_data)
+        entries.extend(setup_tracing(input_data, split, True, options, layout, manifest, cache, runtimes, store))
+        entries.extend(setup_tracing(input_data, split, False, options, layout, manifest, cache, runtimes, store))
+    # Slowest inputs first, handed out one at a time to whichever worker is idle,
+    # so a few slow inputs at the end do not leave the rest of the pool waiting
+    all_tasks = order_by_cost(entries)
+    code_pairs = len({(split, index, is_correct) for split, index, code_index, is_correct, input_index, digest in all_tasks})
+    # Keep the collector from touching (and so copying) the datasets the forked workers share
+    gc.freeze()
+
+    traced_inputs, traced_events, cache_hits = 0, 0, 0
+    outcomes = Counter()
+    start = time.perf_counter()
+    with Pool(options['pool_size'], initializer=init_worker, initargs=(options,), maxtasksperchild=options['max_tasks_per_child']) as pool:
+        for result in tqdm(pool.imap_unordered(trace_input, all_tasks, chunksize=1), total=len(all_tasks)):
+            if result['cached']:
+                manifest.record(result['path'], result['hash'], None)
+                store.add(result)
+                cache_hits += 1
+                continue
+            manifest.record(result['path'], result['hash'], result['error'], result['outcome'], result['seconds'])
+            runtimes.record(result['hash'], result['seconds'])
+            store.add(result)
+            traced_inputs += 1
+            traced_events += result['events']
+            outcomes[result['outcome']] += 1
+    elapsed = time.perf_counter() - start
+    manifest.close()
+    runtimes.close()
+    store.close()
+    if cache is not None:
+        cache_hits += cache.hits
+
+    print(f"Traced {code_pairs} code pairs ({traced_inputs} inputs) of {', '.join(options['splits'])} in {elapsed:.1f}s")
+    print(f"pairs/sec: {code_pairs / elapsed:,.2f}  events/sec: {traced_events / elapsed:,.0f}  cache hits: {cache_hits}")
+    print("outcomes: " + ', '.join(f"{outcome} {count}" for outcome, count in outcomes.most_common()))
+
+    if options['pack']:
+        packed, archives = layout.pack()
+        print(f"Packed {packed} traces into {archives} pid archives")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+import ast
+import functools
+
+from python_tracer import MISSING
+
+
+def describe_value(value) -> str:
+    # A container summary (see `ValueSummarizer`) shows as `list(len=5000, min=1, max=9)`;
+    # its hash and its head and tail elements only add noise to the trace comment
+    if isinstance(value, dict) and 'summary' in value and 'hash' in value:
+        fields = ', '.join(f'{key}={value[key]}' for key in ('len', 'min', 'max') if key in value)
+        return f"{value['summary']}({fields})"
+    return f'{value}'
+
+def describe_changes(changes):
+    # Render `iter_trace_changes` changes the way the trace summary shows them
+    differences = {}
+
+    for key, (old, new) in changes.items():
+        if old is MISSING:
+            differences[key] = describe_value(new)
+        elif new is MISSING:
+            differences[key] = f'returned'
+        else:
+            differences[key] = f'{describe_value(old)} -> {describe_value(new)}'
+
+    return differences
+
+def code_lines(node: ast.AST) -> list:
+    # The header line of `node` and the lines its children span, leaving out blank lines, comments and `else:`
+    lines = {node.lineno}
+    for child in ast.iter_child_nodes(node):
+        for descendant in ast.walk(child):
+            if hasattr(descendant, 'lineno'):
+                lines.update(range(descendant.lineno, descendant.end_lineno + 1))
+    return sorted(lines)
+
+class LoopCollector(ast.NodeVisitor):
+    """Collect the loops of a module for `LoopIndex`, with their nesting depth and enclosing function."""
+
+    def __init__(self) -> None:
+        self.loops = []
+        self.loop_lines = []
+        self.else_lines = []
+        self.depth = 0
+        self.function = None
+
+    def add_loop(self, node: ast.AST, kind: str) -> None:
+        self.loops.append((kind, node.lineno, node.end_lineno, self.depth, self.function))
+        self.loop_lines.append(code_lines(node))
+        self.else_lines.append(frozenset(line for statement in getattr(node, 'orelse', ()) for line in code_lines(statement)))
+        self.depth += 1
+        self.generic_visit(node)
+        self.depth -= 1
+
+    def visit_For(self, node: ast.For) -> None:
+        self.add_loop(node, 'for')
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node: ast.While) -> None:
+        self.add_loop(node, 'while')
+
+    def visit_comprehension_node(self, node: ast.AST) -> None:
+        self.add_loop(node, 'comprehension')
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_comprehension_node
+
+    def visit_FunctionDef(self, node: ast.AST) -> None:
+        function, depth = self.function, self.depth
+        self.function, self.depth = node.name, 0
+        self.generic_visit(node)
+        self.function, self.depth = function, depth
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+class LoopIndex:
+    """The loops of a program, found on its AST (see `index_loops`).
+
+    `loops` holds one `(kind, first line, last line, depth, function)` per loop in
+    source order: `kind` is `for`, `while` or `comprehension`, the lines span the
+    whole statement including an `else` clause, `depth` counts the loops around
+    it in the same function, and `function` is the name of the enclosing function,
+    or None at module level. `lines[i]` lists the lines of loop `i` that hold code,
+    and `else_lines[i]` those of its `else` clause.
+
+    `loop_of_line` maps every line of an outermost `for` or `while` loop to the
+    index of that loop; this is how `compress_trace` groups the steps of a loop.
+    `loops_of_line` maps every line of a `for` or `while` loop to the indices of
+    the loops it is in, outermost first, and `loop_of_header` the header line of
+    each of those loops to its index, for `summarize_trace`."""
+
+    def __init__(self, loops: list, lines: list, else_lines: list) -> None:
+        self.loops = loops
+        self.lines = lines
+        self.else_lines = else_lines
+        self.loop_of_line = {}
+        self.loops_of_line = {}
+        self.loop_of_header = {}
+        for loop_number, (kind, first_line, last_line, depth, function) in enumerate(loops):
+            if kind == 'comprehension':
+                continue
+            self.loop_of_header.setdefault(first_line, loop_number)
+            for line in lines[loop_number]:
+                if depth == 0:
+                    self.loop_of_line.setdefault(line, loop_number)
+                self.loops_of_line[line] = self.loops_of_line.get(line, ()) + (loop_number,)
+
+@functools.lru_cache(maxsize=1024)
+def index_loops(code: str) -> LoopIndex:
+    """Return the `LoopIndex` of `code`, numbered like the lines `compress_trace` sees.
+
+    Results are cached by source; code that does not parse has no loops."""
+    collector = LoopCollector()
+    try:
+        collector.visit(ast.parse(code))
+    except (SyntaxError, ValueError):
+        pass
+    return LoopIndex(collector.loops, collector.loop_lines, collector.else_lines)
+
+def track_final_changes(differences_list):
+    # Initialize a dictionary to store the final changes
+    final_changes = {}
+
+    # Iterate through each differences dictionary in the list
+    for differences in differences_list:
+        for key, change in differences.items():
+            # Parse the changes (if it's a transition like "old -> new", keep the new value)
+            if '->' in change:
+                # Extract the final value from the change
+                new_value = change.split('->')[-1].strip()
+                final_changes[key] = new_value
+            else:
+                # If it's just a new addition or removal, store that
+                final_changes[key] = change
+
+    return final_changes
+
+def format_changes(label, differences) -> str:
+    if len(differences.keys()) == 0:
+        return f'{label}: '
+    return f'{label}: ' + '{' + ' , '.join([f'{k}: {v}' for k, v in differences.items()]) + '}'
+
+def loop_runs(linenos: list, loop_of_line: dict) -> list:
+    """Return, for every index of `linenos`, the `[start, end, loop_number]` run of
+    consecutive indices whose lines belong to the same loop of `loop_of_line`, or
+    None outside loops. Indices of one run share the same list."""
+    runs = [None] * len(linenos)
+    run = None
+    for index, lineno in enumerate(linenos):
+        loop_number = loop_of_line.get(lineno)
+        if loop_number is None:
+            run = None
+            continue
+        if run is None or run[2] != loop_number:
+            run = [index, index, loop_number]
+        else:
+            run[1] = index
+        runs[index] = run
+    return runs
+
+def compress_trace(trace_steps, loop_index: LoopIndex) -> str:
+    difference_data_list = []
+    trace_string_list = []
+
+    # Compress trace data due to token limit; each step carries its changes from the previous one
+    previous_lineno = None
+    for step, trace, changes in trace_steps:
+        if previous_lineno is not None:
+            difference_data_list.append((previous_lineno - 1, describe_changes(changes)))
+        previous_lineno = int(trace['line'])
+
+    # Every run of steps inside one loop is summarized by the final changes of the run
+    runs = loop_runs([lineno for lineno, _ in difference_data_list], loop_index.loop_of_line)
+
+    final_index = 0
+
+    while final_index < len(difference_data_list):
+        lineno, diff_data = difference_data_list[final_index]
+        if lineno == 0:
+            final_index += 1
+            continue
+
+        run = runs[final_index]
+        if run is not None:
+            start, end, loop_number = run
+            compressed_loop = track_final_changes(diff for _, diff in difference_data_list[start:end + 1])
+            trace_string_list.append(format_changes(str(loop_index.lines[loop_number]), compressed_loop))
+            final_index = end + 1
+        else:
+            trace_string_list.append(format_changes(lineno, diff_data))
+            final_index += 1
+
+    return ' | '.join(trace_string_list)
+
+
+def trace_entries(trace_steps) -> list:
+    # `(lineno, changes, skipped)` per step after the first: the line the previous step ran and
+    # the `iter_trace_changes` changes it made, plus what a loop budget left out (see `LoopBudget`)
+    entries = []
+    previous_lineno = None
+    for step, trace, changes in trace_steps:
+        if previous_lineno is not None:
+            entries.append((previous_lineno - 1, changes, trace.get('skipped', ())))
+        previous_lineno = int(trace['line'])
+    return entries
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def trend_of(trend, previous, value):
+    # 'inc' or 'dec' while every change of a number goes the same way, 'mixed' otherwise
+    if not (is_number(previous) and is_number(value)):
+        return 'mixed'
+    if value == previous:
+        return trend
+    direction = 'inc' if value > previous else 'dec'
+    return direction if trend in (None, direction) else 'mixed'
+
+class LoopNode:
+    """One loop in the loop tree of a trace (see `build_loop_tree`).
+
+    All runs of a nested loop within one run of its parent share a node. The node
+    counts those `runs` and their `iterations`, keeps `[first, last, trend]` of
+    every variable changed by the lines of the loop outside its nested loops, and
+    holds the nodes of the nested loops in `children`, in order of first entry."""
+
+    def __init__(self, loop_number: int) -> None:
+        self.loop_number = loop_number
+        self.runs = 0
+        self.iterations = 0
+        self.variables = {}
+        self.children = {}
+
+    def record(self, changes: dict) -> None:
+        for name, (old, new) in changes.items():
+            stats = self.variables.get(name)
+            if stats is None:
+                if old is MISSING:
+                    self.variables[name] = [new, new, None]  # Assigned first in the loop
+                    continue
+                # The value the loop started with, so its first change counts toward the trend
+                stats = self.variables[name] = [old, old, None]
+            stats[2] = trend_of(stats[2], stats[1], new)
+            stats[1] = new
+
+def build_loop_tree(entries: list, loop_index: LoopIndex, max_depth: int = None) -> list:
+    """Return the `trace_entries` as a list of `(lineno, changes)` for lines outside loops
+    and `LoopNode`s for runs of outermost loops, in trace order.
+
+    A loop iteration is counted at every step of the loop header, less the last
+    one when the run leaves the loop through the header or goes from the header
+    into the `else` clause. Iterations a loop budget
+    left out are added to their loop, and the runs of loops nested in them to the
+    nested loop; the changes across the gap count as changes of the loop whose
+    iterations were left out. Loops nested deeper than `max_depth` are not told
+    apart from the loop around them at that depth."""
+    items = []
+    stack = []
+    previous_lineno = None
+
+    def skip(skipped):
+        # Count what a loop budget left out; return the node of the loop whose run goes on
+        owner = None
+        for line, runs, iterations in skipped:
+            loop_number = loop_index.loop_of_header.get(line - 1)
+            if loop_number is None:
+                continue
+            chain = loop_index.loops_of_line[loop_index.loops[loop_number][1]]
+            if max_depth is not None and len(chain) > max_depth + 1:
+                continue
+            common = 0
+            while common < len(stack) and common < len(chain) and stack[common].loop_number == chain[common]:
+                common += 1
+            if runs == 0:
+                if common == len(chain):
+                    node = stack[common - 1]
+                    node.iterations += iterations
+                    if owner is None or len(chain) < len(owner_chain):
+                        owner, owner_chain = node, chain
+                continue
+            if common == 0:
+                continue  # Not nested in a loop being run
+            node = stack[common - 1]
+            for nested_number in chain[common:]:
+                node = node.children.setdefault(nested_number, LoopNode(nested_number))
+            node.runs += runs
+            node.iterations += iterations
+        return owner
+
+    def end_runs(common):
+        # Leave the loops of the stack beyond the first `common`
+        while len(stack) > common:
+            node = stack.pop()
+            if previous_lineno == loop_index.loops[node.loop_number][1]:
+                node.iterations -= 1
+
+    for lineno, changes, skipped in entries:
+        if lineno == 0:
+            continue
+        chain = loop_index.loops_of_line.get(lineno, ())
+        if max_depth is not None:
+            chain = chain[:max_depth + 1]
+
+        common = 0
+        while common < len(stack) and common < len(chain) and stack[common].loop_number == chain[common]:
+            common += 1
+        end_runs(common)
+        for loop_number in chain[common:]:
+            if stack:
+                node = stack[-1].children.setdefault(loop_number, LoopNode(loop_number))
+            else:
+                node = LoopNode(loop_number)
+                items.append(node)
+            node.runs += 1
+            stack.append(node)
+        if stack and lineno in loop_index.else_lines[stack[-1].loop_number]:
+            if previous_lineno == loop_index.loops[stack[-1].loop_number][1]:
+                stack[-1].iterations -= 1
+        previous_lineno = lineno
+
+        if not stack:
+            items.append((lineno, changes))
+            continue
+        node = stack[-1]
+        if lineno == loop_index.loops[node.loop_number][1]:
+            node.iterations += 1
+        if skipped:
+            node = skip(skipped) or node
+        node.record(changes)
+
+    end_runs(0)
+    return items
+
+def render_value(value) -> str:
+    return 'returned' if value is MISSING else describe_value(value)
+
+def render_loop(node: LoopNode, loop_index: LoopIndex, detail: bool) -> str:
+    # `[first line-last line] x<iterations>: {name: first -> last (trend)}` followed by the nested loops in parentheses
+    kind, first_line, last_line, depth, function = loop_index.loops[node.loop_number]
+    label = f'[{first_line}-{last_line}] x{node.iterations}'
+    if node.runs > 1:
+        label += f' in {node.runs} runs'
+
+    variables = {}
+    for name, (first, last, trend) in node.variables.items():
+        first, last = render_value(first), render_value(last)
+        if not detail or first == last:
+            variables[name] = last
+        elif trend in ('inc', 'dec'):
+            variables[name] = f'{first} -> {last} ({trend})'
+        else:
+            variables[name] = f'{first} -> {last}'
+
+    text = format_changes(label, variables)
+    if node.children:
+        text += ' (' + ' | '.join(render_loop(child, loop_index, detail) for child in node.children.values()) + ')'
+    return text
+
+def render_loop_tree(items: list, loop_index: LoopIndex, detail: bool) -> str:
+    trace_string_list = []
+    for item in items:
+        if isinstance(item, LoopNode):
+            trace_string_list.append(render_loop(item, loop_index, detail))
+        else:
+            lineno, changes = item
+            trace_string_list.append(format_changes(lineno, describe_changes(changes)))
+    return ' | '.join(trace_string_list)
+
+def summary_levels(trace_steps, loop_index: LoopIndex):
+    """Yield the summaries of a trace from the most to the least detailed.
+
+    The first keeps the nesting of all loops: each loop is shown with its
+    iteration count and, for every variable, its first and last value and
+    whether it only increased or decreased, with its nested loops after it.
+    Each further summary merges the deepest nested loops into their parents,
+    and the last one only keeps the last values. A summary is only rendered
+    when it is asked for, so a caller that stops at the first one that fits its
+    token budget does not render the others."""
+    entries = trace_entries(trace_steps)
+    max_depth = max((len(chain) for chain in loop_index.loops_of_line.values()), default=1) - 1
+    for depth in range(max_depth, -1, -1):
+        yield render_loop_tree(build_loop_tree(entries, loop_index, depth), loop_index, True)
+    yield render_loop_tree(build_loop_tree(entries, loop_index, 0), loop_index, False)
+
+def summarize_trace(trace_steps, loop_index: LoopIndex) -> str:
+    """Summarize a trace like `compress_trace`, keeping the nesting of its loops
+    (the most detailed of `summary_levels`)."""
+    return next(summary_levels(trace_steps, loop_index))
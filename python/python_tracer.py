@@ -0,0 +1,1266 @@
+from types import FrameType
+from datetime import datetime
+from typing import Callable, Optional, TextIO, Any
+
+import re
+import sys
+import ast
+import dis
+import functools
+import itertools
+import os
+import json
+import builtins
+import time
+import types
+import io
+import gzip
+import hashlib
+import zipfile
+import struct
+from array import array
+from collections import deque
+
+class MaxTraceOrderExceededException(BaseException):
+    """Exception raised when the trace order exceeds the maximum allowed.
+
+    Derived from BaseException, so `except Exception` in the traced program does not swallow it."""
+    pass
+
+class StepLimitExceededException(MaxTraceOrderExceededException):
+    """Exception raised when a traced block runs more events than `max_events`."""
+    pass
+
+class TimeoutException(BaseException):
+    """Exception raised from the trace callback once the deadline has passed.
+
+    Derived from BaseException, so `except Exception` in the traced program does not swallow it."""
+    pass
+
+# Outcomes of tracing one input (see `outcome_of`)
+OUTCOME_OK = 'ok'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_STEP_LIMIT = 'step_limit'
+OUTCOME_TRACE_LIMIT = 'trace_limit'
+OUTCOME_RUNTIME_ERROR = 'runtime_error'
+
+def outcome_of(exception: Optional[BaseException]) -> str:
+    """The outcome code of a traced block that raised `exception` (None if it finished)."""
+    if exception is None:
+        return OUTCOME_OK
+    if isinstance(exception, TimeoutException):
+        return OUTCOME_TIMEOUT
+    if isinstance(exception, StepLimitExceededException):
+        return OUTCOME_STEP_LIMIT
+    if isinstance(exception, MaxTraceOrderExceededException):
+        return OUTCOME_TRACE_LIMIT
+    return OUTCOME_RUNTIME_ERROR
+
+# Bump when a change alters the recorded traces, so cached traces of older versions are not reused
+TRACE_FORMAT_VERSION = 8
+
+# Values that are already JSON-native and can be stored in a snapshot as they are
+JSON_SCALAR_TYPES = (int, float, str, bool, type(None))
+# Values whose serialized form can never change while the object stays alive
+IMMUTABLE_TYPES = JSON_SCALAR_TYPES + (bytes, complex, range)
+# Values that `copy.deepcopy` refuses to copy; these have always been stored as `str(value)`
+UNCOPYABLE_TYPES = (types.ModuleType, io.IOBase)
+# Containers that are fingerprinted by a shallow copy when all their elements are JSON scalars
+FLAT_CONTAINER_TYPES = (list, dict, set, deque)
+JSON_SCALAR_TYPE_SET = frozenset(JSON_SCALAR_TYPES)
+# Containers a `ValueSummarizer` may describe instead of copying
+SUMMARIZED_TYPES = (list, tuple, dict, set, frozenset, deque)
+NUMBER_TYPES = (int, float)
+# Elements of a container that `sample_key` looks at, spread evenly from the first to the last
+SAMPLE_ITEMS = 16
+
+class Missing:
+    """The value of a variable that does not exist, on either side of a change in `iter_trace_changes`."""
+    def __repr__(self) -> str:
+        return 'MISSING'
+
+MISSING = Missing()
+
+def is_immutable(value) -> bool:
+    """Return True if `value` (and everything reachable from it) is immutable."""
+    value_type = type(value)
+    if value_type in IMMUTABLE_TYPES:
+        return True
+    if value_type is tuple or value_type is frozenset:
+        return all(is_immutable(item) for item in value)
+    return False
+
+def sample_key(value: Any, depth: int = 2) -> Any:
+    """A cheap key of `value` that is the same in every run: the type and length
+    of a container and the keys of up to `SAMPLE_ITEMS` of its elements, spread
+    evenly from the first to the last, `depth` containers deep. Sets are keyed
+    by their smallest and largest elements instead, since their order depends on
+    string hashing, which changes between runs (`PYTHONHASHSEED`)."""
+    value_type = type(value)
+    if value_type in JSON_SCALAR_TYPE_SET:
+        return value
+    if value_type in IMMUTABLE_TYPES:
+        return repr(value)
+    if depth == 0 or not isinstance(value, SUMMARIZED_TYPES):
+        return value_type.__name__
+    size = len(value)
+    if isinstance(value, (set, frozenset)):
+        try:
+            ends = (sample_key(min(value), depth - 1), sample_key(max(value), depth - 1)) if size else ()
+        except TypeError:
+            ends = ()  # Elements that cannot be ordered
+        return (value_type.__name__, size) + ends
+    if isinstance(value, dict):
+        items = value.items()
+        if size > SAMPLE_ITEMS:
+            # Dicts cannot be indexed; stepping through the items skips listing all of them
+            items = list(itertools.islice(items, 0, None, -(-size // (SAMPLE_ITEMS - 1)))) + [next(reversed(items))]
+        return (value_type.__name__, size, tuple((sample_key(key, depth - 1), sample_key(item, depth - 1)) for key, item in items))
+    items = value
+    if size > SAMPLE_ITEMS:
+        items = [value[index * (size - 1) // (SAMPLE_ITEMS - 1)] for index in range(SAMPLE_ITEMS)]
+    return (value_type.__name__, size, tuple(sample_key(item, depth - 1) for item in items))
+
+class ValueSummarizer:
+    """Describe a large container in a few fields instead of copying it.
+
+    A container is large when its length, times the length of its first
+    element if that is a container too, is above `threshold`. It is then
+    stored as `{'summary': type name, 'len', 'head', 'tail', 'hash'}`, with
+    `min` and `max` added for sequences of numbers. `head` and `tail` are the
+    first and last `items` elements (`[key, value]` pairs for dicts; sets
+    have no `tail`). `hash` is a digest of the length and a sample of the
+    elements (see `sample_key`), so it takes the same time for any size and is
+    the same in every run; a change between the sampled elements leaves it as
+    it was."""
+
+    def __init__(self, threshold: int = 1000, items: int = 3) -> None:
+        self.threshold = threshold
+        self.items = items
+
+    def is_large(self, value: Any) -> bool:
+        if not isinstance(value, SUMMARIZED_TYPES):
+            return False
+        size = len(value)
+        if 0 < size <= self.threshold:
+            first = next(iter(value.values() if isinstance(value, dict) else value))
+            if isinstance(first, SUMMARIZED_TYPES):
+                size *= len(first)
+        return size > self.threshold
+
+    def fingerprint(self, value: Any) -> str:
+        return hashlib.blake2b(repr(sample_key(value)).encode('utf-8', 'surrogatepass'), digest_size=8).hexdigest()
+
+    def summarize(self, value: Any, snapshot_value: Callable) -> dict:
+        """Return the summary of `value`, with its elements copied by `snapshot_value`."""
+        summary = {'summary': type(value).__name__, 'len': len(value)}
+        if isinstance(value, dict):
+            summary['head'] = [[snapshot_value(key), snapshot_value(item)] for key, item in itertools.islice(value.items(), self.items)]
+            tail = list(itertools.islice(reversed(value.items()), self.items))[::-1]
+            summary['tail'] = [[snapshot_value(key), snapshot_value(item)] for key, item in tail]
+        else:
+            summary['head'] = [snapshot_value(item) for item in itertools.islice(value, self.items)]
+            if not isinstance(value, (set, frozenset)):
+                summary['tail'] = [snapshot_value(item) for item in list(itertools.islice(reversed(value), self.items))[::-1]]
+        summary['hash'] = self.fingerprint(value)
+
+        if not isinstance(value, dict) and summary['head'] and type(summary['head'][0]) in NUMBER_TYPES:
+            try:
+                low, high = min(value), max(value)
+            except TypeError:
+                pass  # Not all numbers
+            else:
+                if type(low) in NUMBER_TYPES and type(high) in NUMBER_TYPES:
+                    summary['min'] = low
+                    summary['max'] = high
+        return summary
+
+class Snapshotter:
+    """Materialize JSON-native copies of frame locals for a `Tracer`.
+
+    Each value is serialized once with `CustomEncoder` and decoded back, which
+    detaches it from the running program the same way `copy.deepcopy` did.
+    Immutable values are remembered by identity, so a variable that still
+    refers to the same object as in the previous event is not serialized again.
+    Mutable values are remembered with a fingerprint (see `fingerprint`), and
+    their snapshot is reused for as long as the variable refers to the same
+    object and the fingerprint still matches, so a value is only copied again
+    once it was really modified. With a `summarizer`, large containers are
+    summarized instead of serialized, and their summary is reused while their
+    `sample_key` matches."""
+
+    IMMUTABLE = ('immutable', None)
+
+    def __init__(self, summarizer: Optional[ValueSummarizer] = None) -> None:
+        self.cache = {}  # variable name -> (value, snapshot, fingerprint)
+        self.summarizer = summarizer
+
+    def snapshot_value(self, value: Any) -> Any:
+        """Return a detached, JSON-native copy of `value`."""
+        if isinstance(value, UNCOPYABLE_TYPES):
+            return str(value)
+        if self.summarizer is not None and self.summarizer.is_large(value):
+            return self.summarizer.summarize(value, self.snapshot_value)
+        try:
+            return json.loads(json.dumps(value, cls=CustomEncoder))
+        except (TypeError, ValueError):
+            return str(value)  # Convert to string if not serializable
+
+    def snapshot(self, f_locals: dict) -> dict:
+        """Return a snapshot of all variables in `f_locals`."""
+        copied_locals = {}
+        for key, value in f_locals.items():
+            if type(value) in JSON_SCALAR_TYPES:
+                copied_locals[key] = value
+                continue
+
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] is value and self.is_unchanged(value, cached[2]):
+                copied_locals[key] = cached[1]
+                continue
+
+            snapshot, fingerprint = self.snapshot_variable(value)
+            if fingerprint is not None:
+                self.cache[key] = (value, snapshot, fingerprint)
+            copied_locals[key] = snapshot
+        return copied_locals
+
+    def snapshot_variable(self, value: Any) -> tuple:
+        """Return the snapshot of `value` and its fingerprint, or None if it cannot be fingerprinted."""
+        if is_immutable(value):
+            return self.snapshot_value(value), self.IMMUTABLE
+        if isinstance(value, UNCOPYABLE_TYPES):
+            return str(value), None
+        fingerprint = self.fingerprint(value)
+        if self.summarizer is not None and self.summarizer.is_large(value):
+            # Nested elements cannot be copied cheaply; a sample is checked like the summary hash
+            return self.snapshot_value(value), fingerprint or ('sample', sample_key(value))
+        try:
+            text = json.dumps(value, cls=CustomEncoder)
+        except (TypeError, ValueError):
+            return str(value), None
+        return json.loads(text), fingerprint or ('json', text)
+
+    def fingerprint(self, value: Any) -> Optional[tuple]:
+        """Return a shallow copy of a container whose elements (and keys) are all
+        JSON scalars, or of the attributes of an object whose attributes all are.
+
+        Comparing it with `==` is exact for such values, except that values
+        that compare equal, like 1 and 1.0, count as unchanged."""
+        if type(value) not in FLAT_CONTAINER_TYPES:
+            attributes = getattr(value, '__dict__', None)
+            if type(attributes) is dict and not callable(value) and set(map(type, attributes.values())) <= JSON_SCALAR_TYPE_SET:
+                return ('attributes', attributes.copy())
+            return None
+        element_types = set(map(type, value))
+        if type(value) is dict:
+            element_types.update(map(type, value.values()))
+        if element_types <= JSON_SCALAR_TYPE_SET:
+            return ('copy', value.copy())
+        return None
+
+    def is_unchanged(self, value: Any, fingerprint: tuple) -> bool:
+        kind, data = fingerprint
+        if kind == 'immutable':
+            return True
+        if kind == 'copy':
+            return value == data
+        if kind == 'attributes':
+            return value.__dict__ == data
+        if kind == 'sample':
+            return sample_key(value) == data
+        try:
+            return json.dumps(value, cls=CustomEncoder) == data
+        except (TypeError, ValueError):
+            return False
+
+class FrameDeltas:
+    """Encode the snapshots of a `Tracer` in delta mode.
+
+    Each event is recorded against the previous event of the same frame:
+    `added` and `changed` map variable names to their new values and
+    `removed` lists the names that are gone. The first event of a frame and
+    every `keyframe_interval`-th event after it are keyframes, which carry
+    all `variables` instead. Frames are numbered in the order they are first
+    seen, and a frame's number is retired when it returns (or yields)."""
+
+    def __init__(self, keyframe_interval: int = 100) -> None:
+        self.keyframe_interval = keyframe_interval
+        self.frames = {}  # id(frame) -> [frame number, variables, events since the keyframe]
+        self.count = 0
+
+    def encode(self, frame: FrameType, variables: dict) -> dict:
+        entry = self.frames.get(id(frame))
+        if entry is None:
+            self.count += 1
+            self.frames[id(frame)] = [self.count, variables, 0]
+            return {'frame': self.count, 'variables': variables}
+
+        number, previous, since_keyframe = entry
+        entry[1] = variables
+        entry[2] = since_keyframe + 1
+        if entry[2] >= self.keyframe_interval:
+            entry[2] = 0
+            return {'frame': number, 'variables': variables}
+
+        added = {}
+        changed = {}
+        for name, value in variables.items():
+            old = previous.get(name, MISSING)
+            if old is value:
+                continue
+            if old is MISSING:
+                added[name] = value
+            elif type(old) is not type(value) or old != value:
+                changed[name] = value
+        removed = []
+        # Every name of `previous` that is still present is in `variables` but not in `added`
+        if len(previous) > len(variables) - len(added):
+            removed = [name for name in previous if name not in variables]
+        return {'frame': number, 'added': added, 'changed': changed, 'removed': removed}
+
+    def end(self, frame: FrameType) -> None:
+        self.frames.pop(id(frame), None)
+
+@functools.lru_cache(maxsize=4096)
+def find_loops(code: types.CodeType) -> dict:
+    """Map the start line of each loop in `code` to its loops, outermost first.
+
+    A loop is found from the backward jumps to one target: it is
+    `(start line, first line, last line)`, where the start line is that of the
+    target, which runs at the beginning of every iteration (the header of a
+    `for` loop, the first body line of a `while True` loop), and the first and
+    last lines span the instructions from the target to the last jump."""
+    instructions = list(dis.get_instructions(code))
+    jumps = {}  # target offset -> offset of the last backward jump to it
+    for instruction in instructions:
+        if instruction.opcode in dis.hasjrel or instruction.opcode in dis.hasjabs:
+            if isinstance(instruction.argval, int) and instruction.argval <= instruction.offset:
+                jumps[instruction.argval] = max(jumps.get(instruction.argval, 0), instruction.offset)
+
+    line_table = [(start, end, line) for start, end, line in code.co_lines() if line is not None]
+    loops = []
+    for target, last_jump in jumps.items():
+        start_line = next((line for start, end, line in line_table if start <= target < end), None)
+        if start_line is None:
+            continue
+        # The line table entry of the target may begin before it, so its line is added separately
+        lines = [start_line] + [line for start, end, line in line_table if target <= start <= last_jump]
+        loops.append((start_line, min(lines), max(lines)))
+
+    starts = {}
+    for loop in sorted(loops, key=lambda loop: loop[1] - loop[2]):
+        starts.setdefault(loop[0], []).append(loop)
+    return starts
+
+class LoopBudget:
+    """Keep the first and the last `budget` iterations of one run of a loop.
+
+    Events of the first iterations are passed to `parent` right away. Later
+    iterations are buffered, only the last `budget` of them are kept, and they
+    are passed on when the loop is left. `parent` is the `emit` of the
+    enclosing loop, or `Tracer.record`.
+
+    The first passed-on event records what was left out in `skipped`, a list of
+    `[first line, runs, iterations]`: the iterations dropped from this run of
+    the loop (with 0 runs, as the run goes on), and the runs and iterations of
+    the loops nested in the dropped iterations, which every nested loop reports
+    to `parent_budget` when it is left. Loops are identified by the first line
+    of `loop` (see `find_loops`), which is that of their header."""
+
+    def __init__(self, parent: Callable, budget: int, loop: tuple, parent_budget: Optional['LoopBudget'] = None) -> None:
+        self.parent = parent
+        self.budget = budget
+        self.start_line, self.first_line, _ = loop
+        self.parent_budget = parent_budget
+        self.iterations = 1
+        self.skipped = 0
+        self.last_line = None  # the last line run while this is the innermost loop
+        self.nested = {}  # first line -> [runs, iterations] of the nested loops left during this run
+        self.dropped = {}  # the same, for the nested loops of the dropped iterations
+        self.buffer = deque()  # the buffered iterations, each ([(frame, step)], nested loops left in it)
+
+    def emit(self, item: tuple) -> None:
+        if self.buffer:
+            self.buffer[-1][0].append(item)
+        else:
+            self.parent(item)
+
+    def next_iteration(self) -> None:
+        self.iterations += 1
+        if self.iterations > self.budget:
+            if len(self.buffer) == self.budget:
+                add_loop_counts(self.dropped, self.buffer.popleft()[1])
+                self.skipped += 1
+            self.buffer.append(([], {}))
+
+    def add_nested(self, counts: dict) -> None:
+        """Count the runs and iterations of nested loops that were left."""
+        add_loop_counts(self.nested, counts)
+        if self.buffer:
+            add_loop_counts(self.buffer[-1][1], counts)
+
+    def run_iterations(self) -> int:
+        # Every iteration starts on the start line; leaving through it is no iteration
+        return self.iterations - (self.last_line == self.start_line)
+
+    def close(self) -> None:
+        first = True
+        while self.buffer:
+            for frame, step in self.buffer.popleft()[0]:
+                if first and self.skipped:
+                    skipped = [[self.first_line, 0, self.skipped]]
+                    skipped.extend([line, runs, iterations] for line, (runs, iterations) in self.dropped.items())
+                    step['skipped'] = step.get('skipped', []) + skipped
+                first = False
+                self.parent((frame, step))
+        if self.parent_budget is not None:
+            add_loop_counts(self.nested, {self.first_line: [1, self.run_iterations()]})
+            self.parent_budget.add_nested(self.nested)
+
+def add_loop_counts(counts: dict, other: dict) -> None:
+    # Add the `[runs, iterations]` of `other` to `counts`, both keyed by the first line of a loop
+    for line, (runs, iterations) in other.items():
+        count = counts.setdefault(line, [0, 0])
+        count[0] += runs
+        count[1] += iterations
+
+class Deadline:
+    """A time and step budget for a traced block, checked from the trace callback.
+
+    The time is read from the monotonic clock, may be a fraction of a second
+    and involves no signals, so it nests with alarms and deadlines of the
+    traced program. `max_steps` bounds the number of events, which also stops
+    programs that are fast per event but never end. The limit exceptions derive
+    from BaseException, so only a bare `except:` catches them; both backends stop
+    tracing once the check raises, so such a program runs on untraced, and
+    `exceeded` keeps the exception, so the input is still reported as having
+    hit the limit. Code that runs without events (a long builtin call,
+    `time.sleep`) is not interrupted; that needs a watchdog outside the process."""
+
+    def __init__(self, seconds: Optional[float] = None, max_steps: Optional[int] = None) -> None:
+        self.seconds = seconds
+        self.max_steps = max_steps
+        self.steps = 0
+        self.expires: Optional[float] = None
+        self.exceeded: Optional[BaseException] = None
+
+    def start(self) -> None:
+        self.steps = 0
+        self.expires = None if self.seconds is None else time.monotonic() + self.seconds
+        self.exceeded = None
+
+    def check(self) -> None:
+        """Count one step; raise if the step limit or the deadline is exceeded."""
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exceeded = StepLimitExceededException(f"Event count exceeded the maximum limit of {self.max_steps}.")
+            raise self.exceeded
+        if self.expires is not None and time.monotonic() >= self.expires:
+            self.exceeded = TimeoutException(f"The block of code took longer than {self.seconds}s to execute.")
+            raise self.exceeded
+
+class FrameFilter:
+    """Select the frames a `Tracer` records.
+
+    The set is built once per traced function: its own code object plus every
+    nested code object (functions, methods, class bodies) whose name is listed
+    in `user_def_function`. Frames are matched by code-object identity."""
+
+    def __init__(self, function: Callable, user_def_function=()) -> None:
+        self.function_names = frozenset(user_def_function) | {function.__name__}
+        self.code_objects = list(self.collect_code_objects(function.__code__))
+        self.code_ids = frozenset(id(code) for code in self.code_objects)
+
+    def collect_code_objects(self, code: types.CodeType):
+        """Yield `code` and its nested code objects whose name is traced."""
+        if code.co_name in self.function_names:
+            yield code
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                yield from self.collect_code_objects(const)
+
+    def __contains__(self, frame: FrameType) -> bool:
+        return id(frame.f_code) in self.code_ids
+
+class SettraceBackend:
+    """Deliver trace events to a `Tracer` through `sys.settrace`."""
+
+    def __init__(self, tracer: 'Tracer') -> None:
+        self.tracer = tracer
+        self.original_trace_function: Optional[Callable] = None
+
+    def _traceit(self, frame: FrameType, event: str, arg: Any) -> Callable:
+        """Internal tracing function."""
+        if frame not in self.tracer.frame_filter:
+            return None  # Do not issue line events for this frame
+        self.tracer.traceit(frame, event, arg)
+        return self._traceit
+
+    def start(self) -> None:
+        self.original_trace_function = sys.gettrace()
+        sys.settrace(self._traceit)
+
+    def stop(self) -> None:
+        sys.settrace(self.original_trace_function)
+
+class MonitoringBackend:
+    """Deliver trace events to a `Tracer` through `sys.monitoring` (PEP 669, Python 3.12+).
+
+    Line, call and return events are enabled only on the code objects of the
+    tracer's frame filter, so all other code runs without tracing overhead.
+    Events are reported under the `sys.settrace` names and at the same points
+    as `sys.settrace` reports them, so both backends produce identical traces."""
+
+    TOOL_NAME = 'variable-trace'
+
+    def __init__(self, tracer: 'Tracer') -> None:
+        self.tracer = tracer
+        self.tool_id = sys.monitoring.DEBUGGER_ID
+        self.active = False
+        # code id -> [(start offset, end offset, line)], to resolve jump targets
+        self.line_tables = {id(code): list(code.co_lines()) for code in tracer.frame_filter.code_objects}
+
+    def start(self) -> None:
+        monitoring = sys.monitoring
+        events = monitoring.events
+        callbacks = {
+            events.PY_START: self.on_call,
+            events.PY_RESUME: self.on_call,
+            events.PY_THROW: self.on_throw,
+            events.LINE: self.on_line,
+            events.JUMP: self.on_jump,
+            events.PY_RETURN: self.on_return,
+            events.PY_YIELD: self.on_return,
+            events.PY_UNWIND: self.on_unwind,
+            events.RAISE: self.on_exception,
+            events.STOP_ITERATION: self.on_exception,
+        }
+        local_events = (events.PY_START | events.PY_RESUME | events.LINE | events.JUMP |
+                        events.PY_RETURN | events.PY_YIELD | events.STOP_ITERATION)
+        # Exception events cannot be enabled per code object; their callbacks filter frames
+        global_events = events.PY_THROW | events.PY_UNWIND | events.RAISE
+
+        monitoring.use_tool_id(self.tool_id, self.TOOL_NAME)
+        for event, callback in callbacks.items():
+            monitoring.register_callback(self.tool_id, event, callback)
+        for code in self.tracer.frame_filter.code_objects:
+            monitoring.set_local_events(self.tool_id, code, local_events)
+        monitoring.set_events(self.tool_id, global_events)
+        self.active = True
+
+    def stop(self) -> None:
+        if not self.active:
+            return
+        self.active = False
+
+        monitoring = sys.monitoring
+        monitoring.set_events(self.tool_id, monitoring.events.NO_EVENTS)
+        for code in self.tracer.frame_filter.code_objects:
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.NO_EVENTS)
+        for event in self.all_events():
+            monitoring.register_callback(self.tool_id, event, None)
+        monitoring.free_tool_id(self.tool_id)
+
+    def all_events(self):
+        events = sys.monitoring.events
+        return (events.PY_START, events.PY_RESUME, events.PY_THROW, events.LINE, events.JUMP,
+                events.PY_RETURN, events.PY_YIELD, events.PY_UNWIND, events.RAISE, events.STOP_ITERATION)
+
+    def record(self, frame: FrameType, event: str, arg: Any) -> None:
+        """Pass an event to the tracer; like `sys.settrace`, stop tracing if it raises."""
+        try:
+            self.tracer.traceit(frame, event, arg)
+        except BaseException:
+            self.stop()
+            raise
+
+    def line_of(self, code: types.CodeType, offset: int) -> Optional[int]:
+        for start, end, line in self.line_tables[id(code)]:
+            if start <= offset < end:
+                return line
+        return None
+
+    def on_call(self, code: types.CodeType, instruction_offset: int) -> None:
+        self.record(sys._getframe(1), 'call', None)
+
+    def on_line(self, code: types.CodeType, line_number: int) -> None:
+        self.record(sys._getframe(1), 'line', None)
+
+    def on_jump(self, code: types.CodeType, instruction_offset: int, destination_offset: int) -> Any:
+        # `sys.settrace` reports a backward jump to the same line (a loop on
+        # one line) as a new line event; everything else is seen by LINE
+        if destination_offset > instruction_offset:
+            return sys.monitoring.DISABLE
+        destination_line = self.line_of(code, destination_offset)
+        if destination_line != self.line_of(code, instruction_offset):
+            return sys.monitoring.DISABLE
+        self.record(sys._getframe(1), 'line', None)
+
+    def on_return(self, code: types.CodeType, instruction_offset: int, retval: object) -> None:
+        self.record(sys._getframe(1), 'return', retval)
+
+    def on_throw(self, code: types.CodeType, instruction_offset: int, exception: BaseException) -> None:
+        frame = sys._getframe(1)
+        if frame in self.tracer.frame_filter:
+            self.record(frame, 'call', None)
+
+    def on_unwind(self, code: types.CodeType, instruction_offset: int, exception: BaseException) -> None:
+        frame = sys._getframe(1)
+        if frame in self.tracer.frame_filter:
+            self.record(frame, 'return', None)
+
+    def on_exception(self, code: types.CodeType, instruction_offset: int, exception: BaseException) -> None:
+        frame = sys._getframe(1)
+        if frame in self.tracer.frame_filter:
+            self.record(frame, 'exception', (type(exception), exception, exception.__traceback__))
+
+def default_backend() -> type:
+    """Use `sys.monitoring` where available and fall back to `sys.settrace`."""
+    if hasattr(sys, 'monitoring'):
+        return MonitoringBackend
+    return SettraceBackend
+
+class TraceWriter:
+    """Stream trace events into a gzip-compressed JSON file as they are produced.
+
+    The file is still a single JSON object keyed by `trace_order`, so it can be
+    loaded with `json.load`, but every event is written on a line of its own,
+    which lets `iter_trace` read it back one event at a time. Events are
+    written to a temporary file that is renamed to `path` on `close`, so a
+    trace file only exists once it is complete."""
+
+    def __init__(self, path: str, compresslevel: int = 6) -> None:
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.file = gzip.open(self.temp_path, 'wt', encoding='utf-8', compresslevel=compresslevel)
+        self.file.write('{')
+        self.count = 0
+
+    def write(self, trace_order: int, step: dict) -> None:
+        separator = ',\n' if self.count else '\n'
+        self.file.write(f'{separator}"{trace_order}": {json.dumps(step, cls=CustomEncoder)}')
+        self.count += 1
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.file.write('\n}\n')
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+class ColumnarTraceWriter:
+    """Write a trace in the compact columnar format read by `iter_columnar_trace`.
+
+    Event, function and variable names and serialized values are interned in
+    tables, the event, function and line of each step are kept in integer
+    arrays, and the variables of a step are stored as the changes against the
+    previous step: `(variable id, value id)` pairs, with value id 0 for a
+    variable that is gone. Steps recorded in delta mode (see `FrameDeltas`)
+    are expanded to their variables first, so the file is the same in both
+    modes. Every `chunk_steps` steps, the tables and columns so far are written
+    out as a chunk and started afresh, so memory is bounded by one chunk
+    however long the trace is. Chunks go to a temporary file that is renamed to
+    `path` on `close`, like `TraceWriter`:
+
+        MAGIC, then chunks until the end of the file, each of length-prefixed
+        blocks: header JSON, values JSON array, events, functions, lines,
+        skipped loop counts (see `LoopBudget`), skipped loop lines, skipped
+        loop runs, skipped loop iterations, delta counts, delta variables,
+        delta values
+
+    Ids refer to the tables of their chunk; the changes of the first step of
+    a chunk are still against the last step of the chunk before."""
+
+    MAGIC = b'VTRC\x04'
+    # (column name, array typecode); the item sizes are recorded in the header
+    COLUMNS = (('events', 'B'), ('functions', 'I'), ('lines', 'I'), ('skipped', 'I'),
+               ('skipped_lines', 'I'), ('skipped_runs', 'I'), ('skipped_iterations', 'Q'),
+               ('delta_counts', 'I'), ('delta_variables', 'I'), ('delta_values', 'I'))
+
+    def __init__(self, path: str, compresslevel: int = 6, chunk_steps: int = 4096) -> None:
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.chunk_steps = chunk_steps
+        self.file = gzip.open(self.temp_path, 'wb', compresslevel=compresslevel)
+        self.file.write(self.MAGIC)
+        self.previous = {}  # variable name -> (snapshot, value id) at the previous step
+        self.frames = {}  # frame number -> variables, for steps recorded in delta mode
+        self.start_chunk()
+
+    def start_chunk(self) -> None:
+        self.tables = {'events': {}, 'functions': {}, 'variables': {}, 'values': {}}
+        self.columns = {name: array(typecode) for name, typecode in self.COLUMNS}
+        # Value ids of the previous chunk mean nothing in the next one
+        self.previous = {name: (value, None) for name, (value, value_id) in self.previous.items()}
+
+    def intern(self, table: str, key: str) -> int:
+        ids = self.tables[table]
+        index = ids.get(key)
+        if index is None:
+            index = ids[key] = len(ids)
+        return index
+
+    def write(self, trace_order: int, step: dict) -> None:
+        columns = self.columns
+        columns['events'].append(self.intern('events', step['event']))
+        columns['functions'].append(self.intern('functions', step['function']))
+        columns['lines'].append(step['line'])
+        skipped = step.get('skipped', ())
+        columns['skipped'].append(len(skipped))
+        for line, runs, iterations in skipped:
+            columns['skipped_lines'].append(line)
+            columns['skipped_runs'].append(runs)
+            columns['skipped_iterations'].append(iterations)
+
+        variables = expand_step(step, self.frames)
+        previous = self.previous
+        count = 0
+        for name, value in variables.items():
+            entry = previous.get(name)
+            # Snapshots are never mutated, so the same object means the same value
+            if entry is not None and entry[0] is value:
+                continue
+            value_id = self.intern('values', json.dumps(value, cls=CustomEncoder)) + 1
+            previous[name] = (value, value_id)
+            if entry is not None and entry[1] == value_id:
+                continue
+            columns['delta_variables'].append(self.intern('variables', name))
+            columns['delta_values'].append(value_id)
+            count += 1
+        # `previous` now holds every current variable, plus those that are gone
+        if len(previous) > len(variables):
+            for name in [name for name in previous if name not in variables]:
+                del previous[name]
+                columns['delta_variables'].append(self.intern('variables', name))
+                columns['delta_values'].append(0)
+                count += 1
+        columns['delta_counts'].append(count)
+        if len(columns['lines']) >= self.chunk_steps:
+            self.write_chunk()
+            self.start_chunk()
+
+    def write_chunk(self) -> None:
+        header = {'steps': len(self.columns['lines']),
+                  'byteorder': sys.byteorder,
+                  'itemsize': {name: column.itemsize for name, column in self.columns.items()},
+                  'events': list(self.tables['events']),
+                  'functions': list(self.tables['functions']),
+                  'variables': list(self.tables['variables'])}
+        blocks = [json.dumps(header).encode('utf-8'),
+                  ('[' + ','.join(self.tables['values']) + ']').encode('utf-8')]
+        blocks.extend(self.columns[name].tobytes() for name, _ in self.COLUMNS)
+        for block in blocks:
+            self.file.write(struct.pack('<Q', len(block)))
+            self.file.write(block)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        if self.columns['lines']:
+            self.write_chunk()
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+def expand_step(step: dict, frames: dict) -> dict:
+    """Return the variables of `step`, rebuilding those of a delta-mode step (see
+    `FrameDeltas`) from `frames`, which maps frame numbers to their last variables."""
+    frame = step.get('frame')
+    if 'variables' in step:
+        variables = step['variables']
+    else:
+        variables = dict(frames[frame])
+        variables.update(step['added'])
+        variables.update(step['changed'])
+        for name in step['removed']:
+            del variables[name]
+    if frame is not None:
+        if step['event'] == 'return':
+            frames.pop(frame, None)
+        else:
+            frames[frame] = variables
+    return variables
+
+def diff_variables(previous: dict, variables: dict) -> dict:
+    """Map each variable that differs between two steps to `(old, new)`, with `MISSING`
+    on the side where it does not exist. Values are compared with `!=`."""
+    changes = {}
+    for name, value in variables.items():
+        old = previous.get(name, MISSING)
+        if old is not value and old != value:
+            changes[name] = (old, value)
+    if len(previous) > len(variables) - len(changes):
+        for name, old in previous.items():
+            if name not in variables:
+                changes[name] = (old, MISSING)
+    return changes
+
+def iter_columnar_trace(f, changes: bool = False):
+    """Yield `(trace_order, step)` pairs, in the dict view of `iter_trace`, from an
+    open columnar trace positioned just after `ColumnarTraceWriter.MAGIC`. With
+    `changes`, yield `(trace_order, step, changes)` like `iter_trace_changes`.
+
+    Steps share the decoded value objects with each other, so treat them as read-only."""
+    def read_block():
+        size, = struct.unpack('<Q', f.read(8))
+        return f.read(size)
+
+    state = {}
+    trace_order = 0
+    # One chunk at a time (see `ColumnarTraceWriter`); the variables carry over
+    while f.peek(1):
+        header = json.loads(read_block())
+        values = json.loads(read_block())
+        columns = {}
+        for name, typecode in ColumnarTraceWriter.COLUMNS:
+            column = array(typecode)
+            if column.itemsize != header['itemsize'][name]:
+                raise ValueError(f"Column {name} was written with {header['itemsize'][name]}-byte items")
+            column.frombytes(read_block())
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+
+        event_names, function_names, variable_names = header['events'], header['functions'], header['variables']
+        events, functions, lines, skipped = columns['events'], columns['functions'], columns['lines'], columns['skipped']
+        skipped_lines, skipped_runs, skipped_iterations = columns['skipped_lines'], columns['skipped_runs'], columns['skipped_iterations']
+        delta_counts, delta_variables, delta_values = columns['delta_counts'], columns['delta_variables'], columns['delta_values']
+        position = 0
+        skipped_position = 0
+        for step in range(header['steps']):
+            end = position + delta_counts[step]
+            step_changes = {}
+            for index in range(position, end):
+                name = variable_names[delta_variables[index]]
+                value_id = delta_values[index]
+                old = state.get(name, MISSING)
+                if value_id:
+                    new = state[name] = values[value_id - 1]
+                else:
+                    new = MISSING
+                    del state[name]
+                # Different serializations can still compare equal, like 1 and 1.0
+                if changes and old != new:
+                    step_changes[name] = (old, new)
+            position = end
+            view = {'event': event_names[events[step]],
+                    'function': function_names[functions[step]],
+                    'line': lines[step]}
+            if skipped[step]:
+                skipped_end = skipped_position + skipped[step]
+                view['skipped'] = [[skipped_lines[index], skipped_runs[index], skipped_iterations[index]]
+                                   for index in range(skipped_position, skipped_end)]
+                skipped_position = skipped_end
+            trace_order += 1
+            if changes:
+                yield str(trace_order), view, step_changes
+            else:
+                view['variables'] = dict(state)
+                yield str(trace_order), view
+
+# Trace file formats: name -> (writer class, file suffix)
+TRACE_FORMATS = {'json': (TraceWriter, '.json.gz'), 'columnar': (ColumnarTraceWriter, '.vtr.gz')}
+# The traces of a directory `<dir>/` can be packed into one uncompressed zip archive `<dir>.zip`
+TRACE_PACK_SUFFIX = '.zip'
+
+def open_trace(path: str, mode: str = 'rb'):
+    """Open the trace file `path`, or the member of that name of the pack of its
+    directory (see `pack_traces`) once the file itself has been packed."""
+    encoding = 'utf-8' if 't' in mode else None
+    pack = os.path.dirname(path) + TRACE_PACK_SUFFIX
+    if os.path.exists(path) or not os.path.exists(pack):
+        return gzip.open(path, mode, encoding=encoding)
+    with zipfile.ZipFile(pack) as archive:
+        data = archive.read(os.path.basename(path))
+    return gzip.open(io.BytesIO(data), mode, encoding=encoding)
+
+def list_traces(directory: str) -> dict:
+    """Map each subdirectory name of `directory` to the paths of its trace files,
+    packed or not. Packed traces are listed under the paths `open_trace` reads them from."""
+    suffixes = tuple(suffix for writer, suffix in TRACE_FORMATS.values())
+    traces = {}
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if entry.endswith(TRACE_PACK_SUFFIX):
+            name = entry[:-len(TRACE_PACK_SUFFIX)]
+            with zipfile.ZipFile(path) as archive:
+                files = archive.namelist()
+        elif os.path.isdir(path):
+            name = entry
+            files = os.listdir(path)
+        else:
+            continue
+        names = traces.setdefault(name, set())
+        names.update(file for file in files if file.endswith(suffixes))
+    return {name: [os.path.join(directory, name, file) for file in sorted(names)] for name, names in traces.items()}
+
+def pack_traces(directory: str) -> int:
+    """Move the trace files of `directory` into its pack `<directory>.zip`, replacing
+    older members of the same name, and remove the directory if it is left empty.
+    The zip central directory indexes the members. Return the number of files packed."""
+    suffixes = tuple(suffix for writer, suffix in TRACE_FORMATS.values())
+    files = sorted(file for file in os.listdir(directory) if file.endswith(suffixes))
+    if not files:
+        if not os.listdir(directory):
+            os.rmdir(directory)
+        return 0
+    pack = directory + TRACE_PACK_SUFFIX
+    temp_path = f"{pack}.tmp"
+    with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as archive:
+        if os.path.exists(pack):
+            with zipfile.ZipFile(pack) as old:
+                for name in old.namelist():
+                    if name not in files:
+                        archive.writestr(old.getinfo(name), old.read(name))
+        for file in files:
+            archive.write(os.path.join(directory, file), file)
+    os.replace(temp_path, pack)
+    for file in files:
+        os.remove(os.path.join(directory, file))
+    if not os.listdir(directory):
+        os.rmdir(directory)
+    return len(files)
+
+def step_view(step: dict) -> dict:
+    """The event, function and line of a step, and the loop iterations skipped before it, if any."""
+    view = {'event': step['event'], 'function': step['function'], 'line': step['line']}
+    if 'skipped' in step:
+        view['skipped'] = step['skipped']
+    return view
+
+def is_columnar_trace(path: str) -> bool:
+    with open_trace(path) as f:
+        return f.read(len(ColumnarTraceWriter.MAGIC)) == ColumnarTraceWriter.MAGIC
+
+def iter_trace(path: str):
+    """Yield `(trace_order, step)` pairs from a trace file of any format, one event at a time.
+
+    Each step is `{'event', 'function', 'line', 'variables'}`, also for traces recorded in delta mode,
+    plus `skipped` after loop iterations left out by a loop budget."""
+    if is_columnar_trace(path):
+        with open_trace(path) as f:
+            f.read(len(ColumnarTraceWriter.MAGIC))
+            yield from iter_columnar_trace(f)
+        return
+
+    frames = {}
+    for trace_order, step in iter_json_trace(path):
+        view = step_view(step)
+        view['variables'] = expand_step(step, frames)
+        yield trace_order, view
+
+def iter_trace_changes(path: str):
+    """Yield `(trace_order, step, changes)` from a trace file of any format, where `step` is
+    `{'event', 'function', 'line'}` and `changes` maps each variable that differs from the
+    previous step (the first step is compared with no variables) to `(old, new)`, with
+    `MISSING` for a variable that does not exist.
+
+    Columnar traces and consecutive delta-mode steps of one frame already store their
+    changes; only the other steps compare their variables with `diff_variables`."""
+    if is_columnar_trace(path):
+        with open_trace(path) as f:
+            f.read(len(ColumnarTraceWriter.MAGIC))
+            yield from iter_columnar_trace(f, changes=True)
+        return
+
+    frames = {}
+    previous = {}
+    previous_frame = None
+    for trace_order, step in iter_json_trace(path):
+        variables = expand_step(step, frames)
+        frame = step.get('frame')
+        if 'variables' not in step and frame == previous_frame:
+            changes = {}
+            for name in step['added']:
+                changes[name] = (MISSING, variables[name])
+            for name in step['changed']:
+                if previous[name] != variables[name]:
+                    changes[name] = (previous[name], variables[name])
+            for name in step['removed']:
+                changes[name] = (previous[name], MISSING)
+        else:
+            changes = diff_variables(previous, variables)
+        yield trace_order, step_view(step), changes
+        previous = variables
+        previous_frame = frame
+
+def iter_json_trace(path: str):
+    """Yield the steps of a `TraceWriter` file as they were written, one event at a time.
+
+    Files written before `TraceWriter` existed are pretty-printed and are loaded whole."""
+    with open_trace(path, 'rt') as f:
+        if f.readline().strip() != '{':
+            f.seek(0)
+            yield from json.load(f).items()
+            return
+
+        for line in f:
+            line = line.rstrip().rstrip(',')
+            if line == '}':
+                return
+            key, separator, value = line.partition(': ')
+            if not value.startswith('{') or not value.endswith('}'):
+                # An opening brace alone on its line: a pretty-printed file
+                f.seek(0)
+                yield from json.load(f).items()
+                return
+            yield json.loads(key), json.loads(value)
+
+class Tracer:
+    """A class for tracing a piece of code. Use as `with Tracer(): block()`"""
+
+    def __init__(self, *, path, frame_filter: FrameFilter,  file: TextIO = sys.stdout, max_trace_order: int = 3000, timeout: Optional[float] = None,
+                 backend: Optional[type] = None, trace_format: str = 'json', delta: bool = False, keyframe_interval: int = 100,
+                 loop_budget: Optional[int] = None, max_events: Optional[int] = None,
+                 summarizer: Optional[ValueSummarizer] = None) -> None:
+        """Trace a block of code into the trace file `path`, sending logs to `file` (default: stdout).
+        `backend` is `SettraceBackend` or `MonitoringBackend` (default: best available).
+        `trace_format` is a key of `TRACE_FORMATS`; `path` should end in its suffix.
+        With `delta`, events record their changed variables only (see `FrameDeltas`).
+        With `loop_budget`, only the first and last `loop_budget` iterations of
+        every run of a loop are recorded (see `LoopBudget`), and the
+        `max_trace_order` limit applies to the recorded events; `max_events`
+        limits all events, recorded or not, so endless loops still stop.
+        `timeout` (seconds, may be fractional) and `max_events` are checked
+        on every event (see `Deadline`).
+        With a `summarizer`, large containers are recorded as summaries."""
+        self.file = file
+        self.file_path = path
+        self.trace_format = trace_format
+        self.writer = None
+        self.trace_order = 0
+        self.frame_filter = frame_filter
+        self.max_trace_order = max_trace_order
+        self.deadline = Deadline(timeout, max_events)
+        self.snapshotter = Snapshotter(summarizer)
+        self.deltas = FrameDeltas(keyframe_interval) if delta else None
+        self.loop_budget = loop_budget
+        self.loops = []  # (frame, loop, LoopBudget) of the loops being run, innermost last
+        self.trace_limit_exceeded: Optional[MaxTraceOrderExceededException] = None
+        self.backend = (backend or default_backend())(self)
+
+    @property
+    def exceeded(self) -> Optional[BaseException]:
+        """The limit exception the tracer raised, if any, even if the traced program caught it."""
+        return self.deadline.exceeded or self.trace_limit_exceeded
+
+    def traceit(self, frame: FrameType, event: str, arg: Any) -> None:
+        """Tracing function."""
+        self.deadline.check()
+        if self.loop_budget is not None:
+            if event == 'line':
+                self.update_loops(frame, frame.f_lineno)
+            elif event == 'return':
+                self.close_loops(frame)
+
+        step = {'event': event,
+                'function': frame.f_code.co_name,
+                'line': frame.f_lineno,
+                'variables': self.snapshotter.snapshot(frame.f_locals)}
+        if self.loops:
+            self.loops[-1][2].emit((frame, step))
+        else:
+            self.record((frame, step))
+
+    def record(self, item: tuple) -> None:
+        """Number a `(frame, step)` event and write it to the trace."""
+        if self.trace_order >= self.max_trace_order:
+            self.trace_limit_exceeded = MaxTraceOrderExceededException(f"Trace order exceeded the maximum limit of {self.max_trace_order}.")
+            raise self.trace_limit_exceeded
+
+        frame, step = item
+        self.trace_order += 1
+        if self.deltas is not None:
+            step.update(self.deltas.encode(frame, step.pop('variables')))
+            if step['event'] == 'return':
+                self.deltas.end(frame)
+        self.writer.write(self.trace_order, step)
+
+    def update_loops(self, frame: FrameType, line: int) -> None:
+        """Follow the loops of `frame` to a line event on `line`: leave the loops it
+        is outside of, start an iteration of the innermost loop if it is its start
+        line, and enter the loops that start there. Note `line` on the innermost loop
+        if it is one of `frame`, so a run knows whether it left through its start line."""
+        loops = self.loops
+        while loops and loops[-1][0] is frame and not loops[-1][1][1] <= line <= loops[-1][1][2]:
+            loops.pop()[2].close()
+
+        starting = find_loops(frame.f_code).get(line)
+        if starting is not None:
+            running = [loop for loop_frame, loop, budget in loops if loop_frame is frame]
+            if running and running[-1] in starting:
+                loops[-1][2].next_iteration()
+            for loop in starting:
+                if loop not in running:
+                    parent_budget = loops[-1][2] if loops else None
+                    parent = parent_budget.emit if parent_budget else self.record
+                    loops.append((frame, loop, LoopBudget(parent, self.loop_budget, loop, parent_budget)))
+        if loops and loops[-1][0] is frame:
+            loops[-1][2].last_line = line
+
+    def close_loops(self, frame: Optional[FrameType] = None) -> None:
+        """Leave the loops of `frame` (of every frame if None), passing on their buffered events."""
+        loops = self.loops
+        while loops and (frame is None or loops[-1][0] is frame):
+            loops.pop()[2].close()
+
+    def __enter__(self):
+        """Called at the beginning of `with` block. Start the deadline and turn tracing on."""
+        self.writer = TRACE_FORMATS[self.trace_format][0](self.file_path)
+        self.deadline.start()
+        self.backend.start()
+        return self
+
+    def __exit__(self, exc_tp, exc_value: BaseException, exc_traceback: Any):
+        """Called at the end of `with` block. Turn tracing off."""
+        self.backend.stop()
+
+        # Pass on the iterations still buffered by loops the block did not leave
+        try:
+            self.close_loops()
+        except MaxTraceOrderExceededException:
+            pass  # The trace is full; keep what was recorded
+        self.loops = []
+
+        # Finish the compressed trace file before exiting
+        self.writer.close()
+
+        # Reraise exceptions if they are not internal errors
+        if exc_tp is not None:
+            if isinstance(exc_value, TimeoutException):
+                print("Timeout occurred during tracing.")
+            return False  # Re-raise exception
+        return None  # All ok
+
+class CustomEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        elif isinstance(obj, types.ModuleType):
+            return f"Module: {obj.__name__}"
+        elif isinstance(obj, types.FunctionType):
+            return f"Function: {obj.__name__}"
+        elif isinstance(obj, types.MethodType):
+            return f"Method: {obj.__name__}"
+        elif callable(obj):
+            return f"Callable: {obj}"
+        elif hasattr(obj, '__dict__'):
+            return obj.__dict__
+        return str(obj)
+
+
+class StdinEmulator:
+    """Serve a test input to the traced program. Use as `with StdinEmulator(lines): block()`
+
+    `sys.stdin`, `sys.stdin.buffer`, `open(0)` (rewritten to `sys.stdin` by
+    `StdinRewriter`) and `input()` all read from one `BytesIO` behind a
+    `TextIOWrapper`, so every way of reading stdin sees the same position.
+    The original `sys.stdin` and `input` are restored on exit."""
+
+    def __init__(self, inputs) -> None:
+        self.data = ("\n".join(inputs) + "\n").encode('utf-8', 'surrogateescape')
+        self.readline = None
+
+    def input(self, prompt=None):
+        """`input()` on the emulated stdin, without the console checks and flushes of the builtin."""
+        if prompt:
+            sys.stdout.write(str(prompt))
+        line = self.readline()
+        if not line:
+            raise EOFError("EOF when reading a line")
+        return line[:-1] if line[-1] == '\n' else line
+
+    def __enter__(self):
+        self.original_stdin = sys.stdin
+        self.original_input = builtins.input
+        sys.stdin = io.TextIOWrapper(io.BytesIO(self.data), encoding='utf-8', errors='surrogateescape', newline='\n')
+        self.readline = sys.stdin.readline
+        builtins.input = self.input
+        return self
+
+    def __exit__(self, exc_tp, exc_value: BaseException, exc_traceback: Any):
+        sys.stdin = self.original_stdin
+        builtins.input = self.original_input
+        return None
+
+class StdinRewriter(ast.NodeTransformer):
+    """Redirect reads of file descriptor 0 to `sys.stdin`.
+
+    `open(0)` becomes `sys.stdin` (`sys.stdin.buffer` in binary mode), so it
+    reads the emulated input like `input()` and `sys.stdin.readline` do."""
+
+    def is_open_stdin(self, node: ast.Call) -> bool:
+        return (isinstance(node.func, ast.Name) and node.func.id == 'open' and len(node.args) >= 1
+                and isinstance(node.args[0], ast.Constant) and node.args[0].value == 0
+                and type(node.args[0].value) is int)
+
+    def is_binary_mode(self, node: ast.Call) -> bool:
+        mode = node.args[1] if len(node.args) >= 2 else None
+        for keyword in node.keywords:
+            if keyword.arg == 'mode':
+                mode = keyword.value
+        return isinstance(mode, ast.Constant) and isinstance(mode.value, str) and 'b' in mode.value
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        self.generic_visit(node)
+        if not self.is_open_stdin(node):
+            return node
+
+        sys_module = ast.Call(func=ast.Name(id='__import__', ctx=ast.Load()), args=[ast.Constant(value='sys')], keywords=[])
+        stdin = ast.Attribute(value=sys_module, attr='stdin', ctx=ast.Load())
+        if self.is_binary_mode(node):
+            stdin = ast.Attribute(value=stdin, attr='buffer', ctx=ast.Load())
+        return ast.copy_location(stdin, node)
+
+@functools.lru_cache(maxsize=4096)
+def compile_wrapper(code):
+    """Compile `code` as the body of `def trace_func():` and return the code object.
+
+    The source is parsed once and stdin reads are rewritten on the AST (see
+    `StdinRewriter`). Line numbers are shifted by one, as if the code had been
+    indented under the `def` line, which is what the traces are numbered by.
+    Results are cached by source; None means the code does not compile."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    if not tree.body:
+        return None
+
+    tree = ast.fix_missing_locations(StdinRewriter().visit(tree))
+    ast.increment_lineno(tree, 1)
+
+    wrapper = ast.parse("def trace_func():\n    pass\n")
+    wrapper.body[0].body = tree.body
+    ast.fix_missing_locations(wrapper)
+    try:
+        return compile(wrapper, '<string>', 'exec')
+    except (SyntaxError, ValueError):
+        return None
+
+def load_function(wrapper_code):
+    """Return the `trace_func` defined by a code object from `compile_wrapper`."""
+    # Run as `__main__`, like the split scripts this code used to live in
+    func_globals = dict(globals(), __name__='__main__')
+    func_dict = {}
+    exec(wrapper_code, func_globals, func_dict)
+    return func_dict['trace_func']
+
+def create_function_from_file(code):
+    wrapper_code = compile_wrapper(code)
+    if wrapper_code is None:
+        return None
+    return load_function(wrapper_code)
+
+def extract_definitions(code):
+    function_pattern = re.compile(r'^\s*def\s+(\w+)\s*\(', re.MULTILINE)
+    class_pattern = re.compile(r'^\s*class\s+(\w+)\s*:', re.MULTILINE)
+
+    user_def = []
+
+    functions = function_pattern.findall(code)
+    classes = class_pattern.findall(code)
+
+    user_def = functions + classes
+
+    return user_def